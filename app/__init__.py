@@ -1,30 +1,78 @@
+import os
 # base flask
 from flask import Flask
 # sql-alchemy support for flask
 from flask_sqlalchemy import SQLAlchemy
-# flask-igrate uses alembic to work with databases
-from flask_migrate import Migrate
 # Gets the Config from our locat config.py file/module
 from config import Config
 # To allow for Cross Origin Resource Sharing to help talk with React
 from flask_cors import CORS
+# Trust X-Forwarded-For from our own proxies (see PROXY_FIX_X_FOR in config.py)
+from werkzeug.middleware.proxy_fix import ProxyFix
+# Faster JSON responses with ISO-8601 dates
+from .json_provider import get_json_provider_class
+# time how long requests wait for a database connection (see pool_metrics.py)
+from .pool_metrics import TimedQueuePool, install_pool_listeners
+# send the reads of GET routes to the read replicas, if there are any (see replicas.py)
+from .replicas import RoutingSession
 
 
-# create instance of Flask
-app = Flask(__name__, instance_relative_config=True)
+# create an instance of SQLAlchemy called db, it is connected to each app in create_app
+db = SQLAlchemy(session_options={'class_' : RoutingSession})
 
-# set config for app and sql database
-app.config.from_object(Config)
 
-# Setup CORS
-CORS(app)
+# Build a new app, every call gets its own config, engines, caches and hooks
+# gunicorn uses the one in wsgi.py, tests and scripts can make their own
+def create_app(config=Config):
+    # create instance of Flask
+    app = Flask(__name__, instance_relative_config=True)
 
-# create an instance of SQLAlchemy called db
-db = SQLAlchemy(app)
+    # set config for app and sql database
+    app.config.from_object(config)
 
-# create an instance of Migrate with the app and db
-migrate = Migrate(app, db)
+    # use orjson (or the stdlib if it isn't installed) for JSON
+    app.json = get_json_provider_class()(app)
 
-# need to import the routes to the application
-# also import the models to the application
-from . import routes, models
\ No newline at end of file
+    # Setup CORS
+    CORS(app)
+
+    # behind proxies request.remote_addr is the proxy, take the client's address from X-Forwarded-For instead
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    # copy the engine options so apps made from the same Config don't share (and change) one dict
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].setdefault('poolclass', TimedQueuePool)
+
+    db.init_app(app)
+
+    # count connections being opened, closed and invalidated
+    with app.app_context():
+        install_pool_listeners(db.engine)
+
+    # imported here so the modules can import db from this package
+    from . import models, routes, replicas, cache, hashing, tokens, response_cache, profiling, prometheus, search, query_plans, sweeper, rate_limit, jobs
+
+    # per-app caches, pools and request hooks
+    # response_cache goes before models: after_request hooks run last-added first, and the cache
+    # invalidations have to run after commit_unit_of_work has committed
+    for module in (response_cache, models, replicas, cache, hashing, tokens, profiling, rate_limit, jobs):
+        module.init_app(app)
+
+    # the routes and the metrics endpoint
+    app.register_blueprint(routes.bp)
+    app.register_blueprint(prometheus.bp)
+
+    # flask create-search-index / flask check-query-plans / flask sweep-tokens / flask run-jobs
+    app.cli.add_command(search.create_search_index_command)
+    app.cli.add_command(query_plans.check_query_plans_command)
+    app.cli.add_command(sweeper.sweep_tokens_command)
+    app.cli.add_command(jobs.run_jobs_command)
+
+    # Flask-Migrate (flask db ...) pulls in alembic, which is slow to import and only
+    # needed on the command line, so web workers skip it (the flask command sets FLASK_RUN_FROM_CLI)
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    return app
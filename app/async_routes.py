@@ -0,0 +1,183 @@
+# Async versions of the read endpoints for the ASGI entry point (asgi.py)
+# They build the same queries as routes.py but run them on SQLAlchemy's asyncio engine
+# (asyncpg / aiosqlite), so a worker can keep serving other requests while one waits on the database
+# Every relationship to_dict() touches is eager loaded, async sessions can't lazy load
+# asgi.py puts the Flask app in application.state.flask_app, its config and JSON provider are used here
+
+import contextlib
+from flask import current_app
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.routing import Route
+from werkzeug.http import parse_etags, parse_date
+from . import db
+from .models import Post, Comment, post_loader_options, post_summary_to_dict
+from .pagination import page_statement, finish_page, ranked_page_statement, finish_ranked_page, PaginationError
+from .conditional import get_validators
+from .rate_limit import check_rate_limit, rate_limit_error, get_client_ip
+from .routes import get_post_fields, get_posts_select, get_comments_select
+from .search import sqlite_fts_available
+
+ASYNC_DRIVERS = {
+    'postgresql' : 'postgresql+asyncpg',
+    'postgres' : 'postgresql+asyncpg',
+    'sqlite' : 'sqlite+aiosqlite',
+}
+
+def get_async_database_url(config):
+    if config.get('ASYNC_DATABASE_URL'):
+        return config['ASYNC_DATABASE_URL']
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    driver = url.drivername.split('+')[0]
+    if driver not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver known for {driver}, set ASYNC_DATABASE_URL")
+    return url.set(drivername=ASYNC_DRIVERS[driver])
+
+
+@contextlib.asynccontextmanager
+async def lifespan(asgi_app):
+    # one engine per worker
+    engine = create_async_engine(get_async_database_url(asgi_app.state.flask_app.config), pool_pre_ping=True)
+    asgi_app.state.async_session = async_sessionmaker(engine, expire_on_commit=False)
+    # Find out now whether SQLite has post_fts (it's remembered), so the first search doesn't
+    # inspect the schema with the sync engine on the event loop
+    await run_blocking(asgi_app.state.flask_app, check_search_backend)
+    yield
+    await engine.dispose()
+
+
+def check_search_backend():
+    if db.engine.dialect.name == 'sqlite':
+        sqlite_fts_available()
+
+
+# Run a blocking call (the sync engine, Redis) in a thread, inside the Flask app context
+async def run_blocking(flask_app, func, *args):
+    def call():
+        with flask_app.app_context():
+            return func(*args)
+    return await run_in_threadpool(call)
+
+
+def json_response(data, status_code=200, headers=None):
+    headers = dict(headers or {})
+    # same as what Flask-CORS sends for the Flask routes
+    headers['Access-Control-Allow-Origin'] = '*'
+    return Response(current_app.json.dumps(data), status_code=status_code, headers=headers, media_type='application/json')
+
+
+def validator_headers(etag, last_modified):
+    headers = {'ETag' : f'W/"{etag}"'}
+    if last_modified:
+        headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    return headers
+
+
+# Same rules as conditional.is_not_modified
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    if_modified_since = parse_date(request.headers.get('if-modified-since'))
+    if if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+async def get_posts(request):
+    args = request.query_params
+    with request.app.state.flask_app.app_context():
+        # same budget as the Flask view, these requests don't carry a user so it's per IP
+        if 'search' in args:
+            client_ip = get_client_ip(request.client.host if request.client else None,
+                                      request.headers.get('x-forwarded-for'), current_app.config['PROXY_FIX_X_FOR'])
+            retry_after = await run_blocking(request.app.state.flask_app, check_rate_limit, 'search', f"ip:{client_ip}")
+            if retry_after:
+                return json_response(*rate_limit_error(retry_after))
+        try:
+            fields = get_post_fields(args)
+            select_stmt, ranked = get_posts_select(fields, args.get('search'))
+            if ranked:
+                select_stmt, limit, offset = ranked_page_statement(select_stmt, args)
+            else:
+                select_stmt, limit = page_statement(select_stmt, Post, args)
+        except (ValueError, PaginationError) as e:
+            return json_response({'error' : str(e)}, 400)
+
+        async with request.app.state.async_session() as session:
+            result = await session.execute(select_stmt)
+            rows = result.all() if fields else result.scalars().all()
+
+        if ranked:
+            posts, next_cursor = finish_ranked_page(rows, limit, offset)
+        else:
+            posts, next_cursor = finish_page(rows, limit)
+
+        # ETag only, like the Flask route (Last-Modified doesn't change when a post leaves the page)
+        etag, _ = get_validators([(p.id, p.last_modified) for p in posts], extra=(next_cursor, fields))
+        headers = validator_headers(etag, None)
+        if is_not_modified(request, etag, None):
+            return Response(status_code=304, headers=headers)
+        if fields:
+            post_dicts = [post_summary_to_dict(p, fields) for p in posts]
+        else:
+            post_dicts = [p.to_dict() for p in posts]
+        return json_response({'posts' : post_dicts, 'next' : next_cursor}, headers=headers)
+
+
+async def get_post(request):
+    post_id = request.path_params['post_id']
+    with request.app.state.flask_app.app_context():
+        async with request.app.state.async_session() as session:
+            # Check the client's cached copy against last_modified before loading anything, like the Flask route
+            last_modified = (await session.execute(
+                db.select(Post.last_modified).where(Post.id == post_id)
+            )).scalar_one_or_none()
+            if last_modified is None:
+                return json_response({'error': f"Post with an ID of {post_id} does not exist"}, 404)
+
+            etag, last_modified = get_validators([(post_id, last_modified)])
+            headers = validator_headers(etag, last_modified)
+            if is_not_modified(request, etag, last_modified):
+                return Response(status_code=304, headers=headers)
+
+            post = (await session.execute(
+                db.select(Post).where(Post.id == post_id).options(*post_loader_options())
+            )).scalar_one_or_none()
+            if post is None:
+                return json_response({'error': f"Post with an ID of {post_id} does not exist"}, 404)
+            # Only the first page of comments, the same as the Flask route
+            select_stmt, limit = page_statement(get_comments_select(post.id), Comment, {}, descending=False)
+            rows = (await session.execute(select_stmt)).scalars().all()
+
+        comments, next_cursor = finish_page(rows, limit)
+        post_dict = post.to_dict()
+        post_dict['comments'] = [c.to_dict() for c in comments]
+        post_dict['commentsNext'] = next_cursor
+        return json_response(post_dict, headers=headers)
+
+
+async def get_comments(request):
+    post_id = request.path_params['post_id']
+    with request.app.state.flask_app.app_context():
+        async with request.app.state.async_session() as session:
+            post = await session.get(Post, post_id)
+            if post is None:
+                return json_response({'error' : f'Post with an id #{post_id} does not exist'}, 404)
+            try:
+                select_stmt, limit = page_statement(get_comments_select(post.id), Comment, request.query_params, descending=False)
+            except PaginationError as e:
+                return json_response({'error' : str(e)}, 400)
+            rows = (await session.execute(select_stmt)).scalars().all()
+
+        comments, next_cursor = finish_page(rows, limit)
+        return json_response({'comments' : [c.to_dict() for c in comments], 'next' : next_cursor})
+
+
+routes = [
+    Route('/posts', get_posts, methods=['GET']),
+    Route('/posts/{post_id:int}', get_post, methods=['GET']),
+    Route('/posts/{post_id:int}/comments', get_comments, methods=['GET']),
+]
@@ -1,8 +1,13 @@
 # For authentication
 from secrets import token_bytes
+from flask import current_app
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
+from sqlalchemy.orm import make_transient_to_detached
 from . import db
-from .models import User
+from .models import User, UserToken, as_utc
+from .cache import token_cache
+from .tokens import load_signed_token
+from .prometheus import AUTH_FAILURES
 from datetime import datetime, timezone
 
 
@@ -10,9 +15,13 @@ basic_auth = HTTPBasicAuth()
 token_auth = HTTPTokenAuth()
 
 
+def user_by_username_select(username):
+    return db.select(User).where(User.username==username)
+
+
 @basic_auth.verify_password
 def verify(username, password):
-    user = db.session.execute(db.select(User).where(User.username==username)).scalar_one_or_none()
+    user = db.session.execute(user_by_username_select(username)).scalar_one_or_none()
     if user is not None and user.check_password(password):
         return user
     return None
@@ -20,17 +29,59 @@ def verify(username, password):
 
 @basic_auth.error_handler
 def handle_error(status_code):
+    AUTH_FAILURES.labels('basic', str(status_code)).inc()
     return {'error' : "Incorrect username and/or password. Please try again"}, status_code
 
 
+# Copy of the user's column values that can outlive the request's session
+def user_snapshot(user):
+    return {column.key : getattr(user, column.key) for column in User.__table__.columns}
+
+
+# Rebuild a User from a snapshot and attach it to this request's session without a SELECT
+# (skips User.__init__, which would hash the password and save)
+def user_from_snapshot(snapshot):
+    user = User.__mapper__.class_manager.new_instance()
+    for key, value in snapshot.items():
+        setattr(user, key, value)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+# The session and its user in one query, expired sessions are skipped until the sweep deletes them
+def token_user_select(token, now):
+    return (
+        db.select(User, UserToken.expires_at)
+        .join(UserToken, UserToken.user_id == User.id)
+        .where(UserToken.token == token, UserToken.expires_at > now)
+    )
+
+
 @token_auth.verify_token
 def verify(token):
-    user = db.session.execute(db.select(User).where(User.token==token)).scalar_one_or_none()
-    if user is not None and (user.token_expiration > datetime.now(timezone.utc)):
-            return user
-    return None
+    # Signed tokens carry the user id, so only the id is set on the user and
+    # everything else loads from the database if a route actually uses it
+    if current_app.config['TOKEN_MODE'] == 'signed':
+        user_id = load_signed_token(token)
+        if user_id is None:
+            return None
+        return user_from_snapshot({'id' : user_id})
+
+    snapshot = token_cache.get(token)
+    if snapshot is not None:
+        return user_from_snapshot(snapshot)
+
+    now = datetime.now(timezone.utc)
+    row = db.session.execute(token_user_select(token, now)).one_or_none()
+    if row is None:
+        return None
+    user, expires_at = row
+    # Cache entries never outlive the token's own expiration
+    token_cache.set(token, user_snapshot(user), expires_in=(as_utc(expires_at) - now).total_seconds())
+    return user
 
 
 @token_auth.error_handler
 def handle_error(status_code):
+    AUTH_FAILURES.labels('token', str(status_code)).inc()
     return {'error' : "Incorrect token. Please try again"}, status_code
\ No newline at end of file
@@ -0,0 +1,73 @@
+# Small in-process caches
+# Each gunicorn worker gets its own copy, so keep the TTLs short enough that
+# changes made through another worker are picked up quickly
+
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+
+# A bounded least-recently-used cache where every entry also has its own expiry time
+class TTLCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the cached value or None if it is missing or expired
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    # expires_in lets an entry expire sooner than the cache's ttl
+    def set(self, key, value, expires_in=None):
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl if expires_in is None else min(self.ttl, expires_in)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size" : len(self._entries),
+                "maxSize" : self.max_size,
+                "hits" : self.hits,
+                "misses" : self.misses
+            }
+
+
+def init_app(app):
+    app.extensions['token_cache'] = TTLCache(app.config['TOKEN_CACHE_SIZE'], app.config['TOKEN_CACHE_TTL'])
+
+
+# token -> snapshot of the user's columns, used by token_auth to skip the user lookup
+# (the current app's cache, each app made by create_app has its own)
+token_cache = LocalProxy(lambda: current_app.extensions['token_cache'])
@@ -0,0 +1,44 @@
+# Conditional GETs with weak ETags and Last-Modified
+# The validators are worked out from (post id, last_modified) pairs, so a client that
+# already has the current version gets a 304 before anything is serialized
+# Listings only send the ETag, Last-Modified is for single posts (see get_posts)
+
+import hashlib
+from flask import request, make_response
+from .models import as_utc
+
+
+# Returns the weak ETag and Last-Modified for a list of (id, last_modified) pairs
+# extra is anything else that changes the response body, like the next page cursor
+def get_validators(versions, extra=None):
+    versions = [(post_id, as_utc(last_modified)) for post_id, last_modified in versions]
+    fingerprint = repr(([(post_id, last_modified.isoformat()) for post_id, last_modified in versions], extra))
+    etag = hashlib.sha1(fingerprint.encode()).hexdigest()
+    last_modified = max((last_modified for _, last_modified in versions), default=None)
+    return etag, last_modified
+
+
+def is_not_modified(etag, last_modified):
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        # HTTP dates only have whole seconds
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+
+def not_modified_response(etag, last_modified):
+    return add_validators(make_response('', 304), etag, last_modified)
+
+
+# Turn a view's return value into a response carrying the validators
+def conditional_response(rv, etag, last_modified):
+    return add_validators(make_response(rv), etag, last_modified)
@@ -0,0 +1,129 @@
+# Password hashing off the request thread
+# generate_password_hash / check_password_hash are slow on purpose and hold the GIL,
+# so they run in a small process pool. When too many are already waiting the request
+# is turned away with a 503 instead of piling up behind them
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from werkzeug.local import LocalProxy
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusy(Exception):
+    pass
+
+
+# forkserver where the platform has it (Linux, macOS), spawn elsewhere. Either way the hashing processes
+# import the main script again, so scripts that hash passwords need an if __name__ == "__main__" guard
+def get_mp_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class PasswordHasher:
+    def __init__(self, workers, queue_limit):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+        # metrics
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    # Made on first use so every gunicorn worker gets its own pool after forking
+    # By then the worker has other threads (job workers), so the hashing processes are started
+    # from a forkserver instead of forking the worker itself
+    def get_executor(self):
+        with self._executor_lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_mp_context())
+                self._pid = os.getpid()
+            return self._executor
+
+    # A hashing process that dies (OOM kill, segfault) breaks the whole pool for good,
+    # so drop it and let the next call start a new one
+    def submit(self, func, *args):
+        executor = self.get_executor()
+        try:
+            return executor.submit(func, *args).result()
+        except BrokenProcessPool:
+            with self._executor_lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+
+    def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy()
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start = time.perf_counter()
+        try:
+            # PASSWORD_HASH_WORKERS = 0 hashes on the request thread, still behind the queue limit
+            if self.workers <= 0:
+                return func(*args)
+            try:
+                return self.submit(func, *args)
+            except BrokenProcessPool:
+                # once more on a new pool, if that one breaks too answer 503
+                try:
+                    return self.submit(func, *args)
+                except BrokenProcessPool:
+                    raise HashingBusy()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+            self._slots.release()
+
+    def hash_password(self, plaintext_password):
+        return self.run(generate_password_hash, plaintext_password)
+
+    def check_password(self, password_hash, plaintext_password):
+        return self.run(check_password_hash, password_hash, plaintext_password)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers" : self.workers,
+                "queueLimit" : self.queue_limit,
+                "queueDepth" : self.in_flight,
+                "maxQueueDepth" : self.max_in_flight,
+                "completed" : self.completed,
+                "rejected" : self.rejected,
+                "averageSeconds" : self.total_seconds / self.completed if self.completed else 0.0,
+                "maxSeconds" : self.max_seconds
+            }
+
+
+def handle_hashing_busy(error):
+    return {'error' : "The server is busy, please try again shortly"}, 503, {'Retry-After' : '1'}
+
+
+def init_app(app):
+    app.extensions['password_hasher'] = PasswordHasher(app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE_LIMIT'])
+    app.register_error_handler(HashingBusy, handle_hashing_busy)
+
+
+# the current app's hasher
+password_hasher = LocalProxy(lambda: current_app.extensions['password_hasher'])
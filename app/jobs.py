@@ -0,0 +1,168 @@
+# Background jobs for the side effects of writes (notifications, search indexing, cache warming...)
+# Creating, editing or deleting a post or comment queues a row in the job table (see the hooks in
+# models.py), and handlers registered here run later on a job worker, outside the request:
+#
+#   @job_handler('comment.created')
+#   def notify_post_author(payload):
+#       ...  # payload is {"id": ..., "user_id": ..., "post_id": ...}
+#
+# Jobs are run by JOB_WORKER_THREADS threads in each web worker (started on its first request)
+# and/or by a separate process: flask run-jobs. The queue is just the table, so jobs survive
+# restarts and there is no broker to run. A job that fails is retried with a growing delay up
+# to JOB_MAX_ATTEMPTS times, and a job whose worker died is picked up again once its lease
+# (JOB_LEASE_SECONDS) runs out (also up to JOB_MAX_ATTEMPTS times, a job that keeps killing its
+# worker is marked failed), so a handler can run more than once and must not mind that
+
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from . import db
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# job kind -> functions that take the payload
+handlers = defaultdict(list)
+
+
+def job_handler(kind):
+    def decorator(handler):
+        handlers[kind].append(handler)
+        return handler
+    return decorator
+
+
+# Jobs that are waiting to run, or whose worker's lease has run out, with attempts left
+def runnable_jobs(now):
+    return (Job.status.in_(('pending', 'running')) & (Job.run_after <= now)
+            & (Job.attempts < current_app.config['JOB_MAX_ATTEMPTS']))
+
+
+# The oldest few jobs that can run, for the workers to try to claim
+def claimable_jobs_select(now):
+    return db.select(Job.id).where(runnable_jobs(now)).order_by(Job.run_after, Job.id).limit(10).with_for_update(skip_locked=True)
+
+
+# Take the oldest job that can run, or None if there isn't one
+# Several workers can poll at once, the UPDATE only succeeds for the one that got there first
+# The UPDATEs don't touch the jobs already in the session (SQLite hands back naive datetimes that
+# can't be compared with now), the commit expires them anyway
+def claim_job():
+    now = datetime.now(timezone.utc)
+    # A lease that ran out on the last attempt means the job took its worker down (or hung) every
+    # time, run_job never got to mark it so do it here instead of handing it out again
+    db.session.execute(
+        db.update(Job)
+        .where(Job.status == 'running', Job.run_after <= now, Job.attempts >= current_app.config['JOB_MAX_ATTEMPTS'])
+        .values(status='failed', last_error=db.func.coalesce(Job.last_error, "Lease ran out, the worker died or hung running it"))
+        .execution_options(synchronize_session=False)
+    )
+    runnable = runnable_jobs(now)
+    candidates = db.session.execute(claimable_jobs_select(now)).scalars().all()
+    for job_id in candidates:
+        lease_until = now + timedelta(seconds=current_app.config['JOB_LEASE_SECONDS'])
+        result = db.session.execute(
+            db.update(Job).where(Job.id == job_id, runnable)
+            .values(status='running', attempts=Job.attempts + 1, run_after=lease_until)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            db.session.commit()
+            return db.session.get(Job, job_id)
+    db.session.commit()
+    return None
+
+
+def run_job(job):
+    try:
+        for handler in handlers[job.kind]:
+            handler(job.payload)
+        db.session.delete(job)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Job %s (%s) failed", job.id, job.kind)
+        if job.attempts >= current_app.config['JOB_MAX_ATTEMPTS']:
+            job.status = 'failed'
+        else:
+            # wait 2, 4, 8... seconds before trying again
+            job.status = 'pending'
+            job.run_after = datetime.now(timezone.utc) + timedelta(seconds=2 ** job.attempts)
+        job.last_error = repr(e)[:1000]
+        db.session.commit()
+
+
+# Run jobs until there are none left that can run now, returns how many were run
+def run_pending_jobs(max_jobs=None):
+    count = 0
+    while max_jobs is None or count < max_jobs:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def work(app, stop):
+    while not stop.is_set():
+        with app.app_context():
+            try:
+                count = run_pending_jobs(max_jobs=100)
+            except Exception:
+                logger.exception("Job worker could not reach the job table")
+                count = 0
+            finally:
+                db.session.remove()
+        if not count:
+            stop.wait(app.config['JOB_POLL_INTERVAL'])
+
+
+# Start worker threads for this process, they stop when stop is set (or with the process)
+def start_workers(app, threads):
+    stop = threading.Event()
+    for i in range(threads):
+        threading.Thread(target=work, args=(app, stop), name=f"job-worker-{i}", daemon=True).start()
+    return stop
+
+
+def init_app(app):
+    threads = app.config['JOB_WORKER_THREADS']
+    if threads <= 0:
+        return
+    started_pid = None
+    lock = threading.Lock()
+
+    # Started on the first request instead of here, so they run in the gunicorn worker (not a
+    # preloading master that forks afterwards) and flask commands like db upgrade don't start them
+    @app.before_request
+    def start_job_workers():
+        nonlocal started_pid
+        if started_pid != os.getpid():
+            with lock:
+                if started_pid != os.getpid():
+                    app.extensions['job_workers'] = start_workers(app, threads)
+                    started_pid = os.getpid()
+
+
+# flask run-jobs, a separate job worker process
+@click.command('run-jobs')
+@click.option('--threads', type=int, default=1, help="Jobs run at the same time")
+@click.option('--once', is_flag=True, help="Run the jobs that are due and exit")
+@with_appcontext
+def run_jobs_command(threads, once):
+    if once:
+        print(f"{run_pending_jobs()} jobs run")
+        return
+    stop = start_workers(current_app._get_current_object(), threads)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
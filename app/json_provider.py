@@ -0,0 +1,44 @@
+# JSON for every response
+# orjson when it is installed (several times faster, encodes datetimes itself), otherwise the stdlib
+# Either way datetimes come out as ISO-8601, with naive ones (the DateTime columns) treated as UTC
+
+from datetime import date, datetime, timezone
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_default(o):
+    if isinstance(o, datetime):
+        if o.tzinfo is None:
+            o = o.replace(tzinfo=timezone.utc)
+        return o.isoformat()
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    default = staticmethod(json_default)
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    options = orjson.OPT_NAIVE_UTC if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=json_default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    # Skip the bytes -> str -> bytes round trip of the default response()
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=json_default, option=self.options), mimetype=self.mimetype)
+
+
+def get_json_provider_class():
+    return ORJSONProvider if orjson else StdlibJSONProvider
@@ -2,9 +2,56 @@
 # models of class CamelCase will automatically create tables snake_case
 
 import secrets
+from collections import Counter
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 from . import db
+from .cache import token_cache
 from datetime import datetime, timezone, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
+from .hashing import password_hasher
+
+
+# Commit now, or in unit-of-work mode just flush (so new rows get their ids)
+# and let commit_unit_of_work commit everything once at the end of the request
+def save_changes():
+    if current_app.config['UNIT_OF_WORK']:
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def commit_unit_of_work(response):
+    if current_app.config['UNIT_OF_WORK'] and response.status_code < 400:
+        db.session.commit()
+    return response
+
+
+def init_app(app):
+    app.after_request(commit_unit_of_work)
+
+
+# One multi-row INSERT ... RETURNING id for a whole batch
+# enqueue=False skips the created jobs, for seeding and imports that aren't new activity
+def bulk_insert(model, rows, enqueue=True):
+    if not rows:
+        return []
+    result = db.session.execute(db.insert(model).returning(model.id, sort_by_parameter_order=True), rows)
+    ids = result.scalars().all()
+    # Core inserts skip the mapper events below, so the created events are queued here (one more INSERT)
+    if enqueue and model in EVENT_MODELS:
+        enqueue_events(db.session.connection(), f"{model.__tablename__}.created",
+                       [event_payload(dict(row, id=new_id)) for row, new_id in zip(rows, ids)])
+    save_changes()
+    return ids
+
+
+# SQLite hands back naive datetimes even for timezone=True columns
+def as_utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
 
 class User(db.Model):
     # use db. to use SQLAlchemy types
@@ -16,14 +63,17 @@ class User(db.Model):
     password = db.Column(db.String, nullable=False)
     date_created = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(tz=timezone.utc))
 
-    # Create token and token expiration column, both allowed to be null or None
-    token = db.Column(db.String, index=True, unique=True)
-    token_expiration = db.Column(db.DateTime(timezone=True))
-
-    # Create a link to the posts table and comments table
+    # Create a link to the posts table, comments table and login sessions
     posts = db.relationship('Post', back_populates='author')
     comments = db.relationship('Comment', back_populates='user')
+    tokens = db.relationship('UserToken', back_populates='user')
+
+    # Emails are unique whatever their case, so Bob@rad.com can't sign up again as bob@rad.com
+    __table_args__ = (
+        db.Index('ix_user_email_lower', db.func.lower(email), unique=True),
+    )
 
+    # only builds the user, call save() to insert it
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.set_password(kwargs.get('password', ''))
@@ -32,18 +82,17 @@ class User(db.Model):
         return f"<User {self.id}|{self.username}>"
 
 
-    # now automatically will add and commit to database when creating the user
+    # add and commit the user to the database
     def save(self):
         db.session.add(self)
-        db.session.commit()
+        save_changes()
 
      # hashes the password for security
     def set_password(self, plaintext_password):
-        self.password = generate_password_hash(plaintext_password)
-        self.save()
+        self.password = password_hasher.hash_password(plaintext_password)
 
     def check_password(self, plaintext_password):
-        return check_password_hash(self.password, plaintext_password)
+        return password_hasher.check_password(self.password, plaintext_password)
     
     def to_dict(self):
         return {
@@ -55,21 +104,19 @@ class User(db.Model):
             "dateCreated" : self.date_created            
         }
     
-    # Creates a new token or if one is valid returns current token
+    # Starts a new session with its own token, so logging in again (or on another device)
+    # doesn't log out the others. This is one INSERT into user_token, the user row isn't touched
     def get_token(self):
-        now = datetime.now(timezone.utc)
-        if self.token and (self.token_expiration > now + timedelta(minutes=1)):
-            return self.token
-        self.token = secrets.token_hex(16)
-        self.token_expiration = now + timedelta(hours=1)
-        self.save()
-        return {
-            "token" : self.token,
-            "tokenExpiration" : self.token_expiration
-        }
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=current_app.config['TOKEN_LIFETIME'])
+        user_token = UserToken(user_id=self.id, token=secrets.token_hex(16), expires_at=expires_at)
+        # build the dict before saving, afterwards it would reload the row just to read it back
+        token_dict = user_token.to_dict()
+        user_token.save()
+        return token_dict
 
 # Example of creating a user:
 # u = User(first_name="Bob", last_name="Dylan", email="bd@rad.com", username="thebobdylan", password="123")
+# u.save()
     
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -78,11 +125,21 @@ class Post(db.Model):
     date_created = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
     # In PgSQL - user_id INTEGER NOT NULL, FOREIGN KEY(user_id) REFERENCES user(id)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Bumped whenever the post or its comments change, used for ETag / Last-Modified
+    last_modified = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    # Kept up to date by Post.touch so listings don't have to count comments
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Creates link to the user and comment table 
     author = db.relationship('User', back_populates='posts')
     comments = db.relationship('Comment', back_populates='post')
 
+    # Indexes for the listing order (GET /posts) and for user.posts newest first
+    __table_args__ = (
+        db.Index('ix_post_date_created_id', 'date_created', 'id'),
+        db.Index('ix_post_user_id_date_created', 'user_id', 'date_created'),
+    )
+
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
         self.save()
@@ -92,12 +149,13 @@ class Post(db.Model):
 
     def save(self):
         db.session.add(self)
-        db.session.commit()
+        save_changes()
     
     def delete(self):
         db.session.delete(self) # deletes THIS object from the database
-        db.session.commit() # commit the change to remove from database
+        save_changes() # commit the change to remove from database
 
+    # The comments are left out, a thread can be any size so it is paged through GET /posts/<id>/comments
     def to_dict(self):
         return {
             "id" : self.id,
@@ -105,7 +163,7 @@ class Post(db.Model):
             "body" : self.body,
             "dateCreated" : self.date_created,
             "author" : self.author.to_dict(),
-            "comments" : [comment.to_dict() for comment in self.comments]
+            "commentCount" : self.comment_count
         }
     
     def update(self, **kwargs):
@@ -114,8 +172,25 @@ class Post(db.Model):
         for key, value in kwargs.items():
             if key in allowed_fields:
                 setattr(self, key, value)
+        self.last_modified = datetime.now(timezone.utc)
         self.save()
 
+    # Mark a post as changed without loading it, e.g. when one of its comments is added or removed
+    # comment_delta is added to comment_count in the same UPDATE
+    @staticmethod
+    def touch(post_id, comment_delta=0):
+        db.session.execute(db.update(Post).where(Post.id == post_id).values(
+            last_modified=datetime.now(timezone.utc),
+            comment_count=Post.comment_count + comment_delta
+        ))
+
+    # Insert many posts in one round trip, skipping __init__/save
+    # rows is a list of column dicts, returns the new ids in the same order
+    @classmethod
+    def bulk_insert(cls, rows, enqueue=True):
+        return bulk_insert(cls, rows, enqueue)
+
+
 
 # Make comments table
 class Comment(db.Model):
@@ -130,9 +205,16 @@ class Comment(db.Model):
     user = db.relationship('User', back_populates='comments')
     post = db.relationship('Post', back_populates='comments')
 
+    # Indexes for post.comments / GET /posts/<id>/comments in thread order, and for user.comments
+    __table_args__ = (
+        db.Index('ix_comment_post_id_date_created_id', 'post_id', 'date_created', 'id'),
+        db.Index('ix_comment_user_id', 'user_id'),
+    )
+
     # __init__ is like INSERT INTO
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
+        Post.touch(self.post_id, comment_delta=1)
         self.save()
 
     def __repr__(self):
@@ -140,11 +222,20 @@ class Comment(db.Model):
 
     def save(self):
         db.session.add(self)
-        db.session.commit()
+        save_changes()
 
     def delete(self):
+        Post.touch(self.post_id, comment_delta=-1)
         db.session.delete(self)
-        db.session.commit()
+        save_changes()
+
+    # Insert many comments in one round trip, see Post.bulk_insert
+    @classmethod
+    def bulk_insert(cls, rows, enqueue=True):
+        comment_counts = Counter(row['post_id'] for row in rows)
+        for post_id, count in comment_counts.items():
+            Post.touch(post_id, comment_delta=count)
+        return bulk_insert(cls, rows, enqueue)
 
     def to_dict(self):
         return {
@@ -153,4 +244,172 @@ class Comment(db.Model):
             "dateCreated" : self.date_created,
             "post_id" : self.post_id,
             "user": self.user.to_dict()
-        }
\ No newline at end of file
+        }
+
+
+# One row per login session, a user can have several at once
+# Expired rows are left alone here and deleted in batches by flask sweep-tokens (see sweeper.py)
+class UserToken(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    token = db.Column(db.String, nullable=False, unique=True, index=True)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+    date_created = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    user = db.relationship('User', back_populates='tokens')
+
+    def __repr__(self):
+        return f"<UserToken {self.id}|user {self.user_id}>"
+
+    def save(self):
+        db.session.add(self)
+        save_changes()
+
+    # Same shape as issue_signed_token returns
+    def to_dict(self):
+        return {
+            "token" : self.token,
+            "tokenExpiration" : self.expires_at
+        }
+
+    # Logs out one session
+    @staticmethod
+    def revoke(token):
+        token_cache.delete(token)
+        db.session.execute(db.delete(UserToken).where(UserToken.token == token))
+        save_changes()
+
+
+# Signed tokens that were logged out before they expired
+# Rows can be deleted once expires_at has passed, the signature check rejects those tokens anyway
+class RevokedToken(db.Model):
+    jti = db.Column(db.String, primary_key=True)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<RevokedToken {self.jti}>"
+
+    # merge so logging out the same token twice doesn't hit the primary key
+    def save(self):
+        db.session.merge(self)
+        save_changes()
+
+
+# Side effects of writes, run later by the job workers (see jobs.py)
+# Jobs are inserted in the same transaction as the write, so a write that rolls back leaves no job behind
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # "<table>.<created|updated|deleted>"
+    kind = db.Column(db.String, nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    # pending or running, or failed once JOB_MAX_ATTEMPTS is used up (finished jobs are deleted)
+    status = db.Column(db.String, nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # when it can run (again), for a running job when its lease runs out and another worker may take it
+    run_after = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    last_error = db.Column(db.String)
+    date_created = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    # Workers look for the oldest jobs that can run
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+    def __repr__(self):
+        return f"<Job {self.id}|{self.kind} {self.status}>"
+
+
+# Writes to these models queue a job for every change, whether or not anything consumes it yet,
+# so the cost of a write stays one extra INSERT however many handlers are added (see jobs.py)
+EVENT_FIELDS = ('id', 'user_id', 'post_id')
+EVENT_MODELS = (Post, Comment)
+
+
+def event_payload(values):
+    return {field : values[field] for field in EVENT_FIELDS if field in values}
+
+
+def enqueue_events(connection, kind, payloads):
+    if payloads:
+        connection.execute(db.insert(Job), [{'kind' : kind, 'payload' : payload} for payload in payloads])
+
+
+def target_payload(target):
+    return event_payload({field : getattr(target, field) for field in EVENT_FIELDS if hasattr(target, field)})
+
+
+@event.listens_for(Post, 'after_insert')
+@event.listens_for(Comment, 'after_insert')
+def enqueue_created(mapper, connection, target):
+    enqueue_events(connection, f"{mapper.local_table.name}.created", [target_payload(target)])
+
+
+@event.listens_for(Post, 'after_update')
+@event.listens_for(Comment, 'after_update')
+def enqueue_updated(mapper, connection, target):
+    # after_update also runs for objects that were only marked dirty
+    if object_session(target).is_modified(target, include_collections=False):
+        enqueue_events(connection, f"{mapper.local_table.name}.updated", [target_payload(target)])
+
+
+@event.listens_for(Post, 'after_delete')
+@event.listens_for(Comment, 'after_delete')
+def enqueue_deleted(mapper, connection, target):
+    enqueue_events(connection, f"{mapper.local_table.name}.deleted", [target_payload(target)])
+
+
+# Loader options for serializing posts with to_dict()
+# selectinload runs one extra SELECT ... WHERE id IN (...) for the authors instead of one per post,
+# so a page of posts is always 2 queries: posts, authors
+def post_loader_options():
+    return [db.selectinload(Post.author)]
+
+
+# Fields allowed in GET /posts?fields=..., mapped to the columns they need
+# view=summary is the default set, everything a list page shows
+POST_SUMMARY_FIELDS = {
+    "id" : [Post.id],
+    "title" : [Post.title],
+    "body" : [Post.body],
+    "dateCreated" : [Post.date_created],
+    "commentCount" : [Post.comment_count],
+    "author" : [User.id.label('author_id'), User.username.label('author_username'),
+                User.first_name.label('author_first_name'), User.last_name.label('author_last_name')],
+}
+POST_SUMMARY_DEFAULT_FIELDS = ["id", "title", "dateCreated", "commentCount", "author"]
+
+
+# A select of just the columns for the requested fields, returning rows instead of Post objects
+# id, date_created and last_modified are always selected, pagination and the ETag need them
+def post_summary_select(fields):
+    columns = [Post.id, Post.date_created, Post.last_modified]
+    for field in fields:
+        if field not in ("id", "dateCreated"):
+            columns.extend(POST_SUMMARY_FIELDS[field])
+    select_stmt = db.select(*columns)
+    if "author" in fields:
+        select_stmt = select_stmt.join(Post.author)
+    return select_stmt
+
+
+def post_summary_to_dict(row, fields):
+    post_dict = {}
+    for field in fields:
+        if field == "id":
+            post_dict["id"] = row.id
+        elif field == "title":
+            post_dict["title"] = row.title
+        elif field == "body":
+            post_dict["body"] = row.body
+        elif field == "dateCreated":
+            post_dict["dateCreated"] = row.date_created
+        elif field == "commentCount":
+            post_dict["commentCount"] = row.comment_count
+        elif field == "author":
+            post_dict["author"] = {
+                "id" : row.author_id,
+                "username" : row.author_username,
+                "firstName" : row.author_first_name,
+                "lastName" : row.author_last_name
+            }
+    return post_dict
@@ -0,0 +1,121 @@
+# Keyset (cursor) pagination helpers
+# Instead of OFFSET, each page asks for rows that come after the last row of the previous page
+# using the (date_created, id) pair, so every page costs the same no matter how deep you go
+
+import base64
+import json
+from datetime import datetime
+from flask import current_app
+from . import db
+
+
+class PaginationError(ValueError):
+    pass
+
+
+# Turn the last row of a page into an opaque string the client sends back as ?cursor=
+def encode_cursor(date_created, row_id):
+    raw = json.dumps([date_created.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date_created, row_id = json.loads(raw)
+        return datetime.fromisoformat(date_created), int(row_id)
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+
+
+# Read ?limit= from the request args, falling back to and capping at the values in Config
+def get_limit(args):
+    default_limit = current_app.config['PAGINATION_DEFAULT_LIMIT']
+    max_limit = current_app.config['PAGINATION_MAX_LIMIT']
+    limit = args.get('limit', default_limit)
+    try:
+        limit = int(limit)
+    except (ValueError, TypeError):
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be at least 1")
+    return min(limit, max_limit)
+
+
+# Apply the cursor and limit to a select statement on model
+# Returns the statement to run (asking for one extra row to find out if there is another page
+# without a COUNT query) and the page size to pass to finish_page
+def page_statement(select_stmt, model, args, descending=True):
+    limit = get_limit(args)
+    cursor = args.get('cursor')
+
+    if cursor:
+        date_created, row_id = decode_cursor(cursor)
+        if descending:
+            select_stmt = select_stmt.where(
+                (model.date_created < date_created) | ((model.date_created == date_created) & (model.id < row_id))
+            )
+        else:
+            select_stmt = select_stmt.where(
+                (model.date_created > date_created) | ((model.date_created == date_created) & (model.id > row_id))
+            )
+
+    if descending:
+        select_stmt = select_stmt.order_by(model.date_created.desc(), model.id.desc())
+    else:
+        select_stmt = select_stmt.order_by(model.date_created.asc(), model.id.asc())
+
+    return select_stmt.limit(limit + 1), limit
+
+
+# Returns the rows for this page and the cursor for the next one (None on the last page)
+def finish_page(rows, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].date_created, rows[-1].id)
+    return rows, next_cursor
+
+
+# Run one page of select_stmt, see page_statement / finish_page
+# scalars=False returns Row objects, for selects of columns instead of a model
+def paginate(select_stmt, model, args, descending=True, scalars=True):
+    select_stmt, limit = page_statement(select_stmt, model, args, descending)
+    result = db.session.execute(select_stmt)
+    rows = result.scalars().all() if scalars else result.all()
+    return finish_page(rows, limit)
+
+
+# Search results are ordered by relevance, which has no stable (date_created, id) order to seek on
+# so those pages use an offset wrapped in the same kind of opaque cursor
+def ranked_page_statement(select_stmt, args):
+    limit = get_limit(args)
+    cursor = args.get('cursor')
+
+    offset = 0
+    if cursor:
+        try:
+            offset = int(json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())['offset'])
+        except (ValueError, TypeError, KeyError):
+            raise PaginationError("Invalid cursor")
+        # Postgres rejects a negative OFFSET
+        if offset < 0:
+            raise PaginationError("Invalid cursor")
+
+    return select_stmt.offset(offset).limit(limit + 1), limit, offset
+
+
+def finish_ranked_page(rows, limit, offset):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        raw = json.dumps({'offset' : offset + limit})
+        next_cursor = base64.urlsafe_b64encode(raw.encode()).decode()
+    return rows, next_cursor
+
+
+def paginate_ranked(select_stmt, args, scalars=True):
+    select_stmt, limit, offset = ranked_page_statement(select_stmt, args)
+    result = db.session.execute(select_stmt)
+    rows = result.scalars().all() if scalars else result.all()
+    return finish_ranked_page(rows, limit, offset)
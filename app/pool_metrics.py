@@ -0,0 +1,83 @@
+# Connection pool telemetry for GET /metrics/worker
+# How long requests wait for a connection, how full the pool is and how often connections
+# are opened and closed, to help pick DB_POOL_SIZE / DB_MAX_OVERFLOW per worker
+
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.checkout_timeouts = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+
+    def record_checkout(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+
+    def record(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self, pool):
+        with self._lock:
+            stats = {
+                "checkouts" : self.checkouts,
+                "checkoutWaitAverageSeconds" : self.checkout_wait_total / self.checkouts if self.checkouts else 0.0,
+                "checkoutWaitMaxSeconds" : self.checkout_wait_max,
+                "checkoutTimeouts" : self.checkout_timeouts,
+                "connectionsOpened" : self.connects,
+                "connectionsClosed" : self.closes,
+                "connectionsInvalidated" : self.invalidations,
+            }
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + pool._max_overflow if pool._max_overflow >= 0 else None
+            stats.update({
+                "poolSize" : pool.size(),
+                "maxOverflow" : pool._max_overflow,
+                "checkedOut" : pool.checkedout(),
+                "idle" : pool.checkedin(),
+                "saturation" : pool.checkedout() / capacity if capacity else None,
+            })
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+# QueuePool that times how long connect() waits for a free connection
+class TimedQueuePool(QueuePool):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_metrics.record("checkout_timeouts")
+            raise
+        pool_metrics.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+def install_pool_listeners(engine):
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        pool_metrics.record("connects")
+
+    @event.listens_for(engine, "close")
+    def on_close(dbapi_connection, connection_record):
+        pool_metrics.record("closes")
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool_metrics.record("invalidations")
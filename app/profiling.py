@@ -0,0 +1,69 @@
+# Per-request timing
+# Every response gets a Server-Timing header with the total time, the time spent in SQL and
+# the number of statements. Statements slower than SLOW_QUERY_THRESHOLD_MS are logged with
+# the route they came from. With PROFILE_HEADER_ENABLED on, sending "X-Profile: 1" runs the
+# request under cProfile and saves the stats to PROFILE_DIR
+
+import cProfile
+import logging
+import os
+import time
+from flask import g, request, has_request_context, current_app
+from sqlalchemy import event
+from . import db
+
+logger = logging.getLogger(__name__)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    endpoint = None
+    if has_request_context():
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.sql_time = g.get('sql_time', 0.0) + elapsed
+        endpoint = request.endpoint
+    if elapsed * 1000 >= current_app.config['SLOW_QUERY_THRESHOLD_MS']:
+        logger.warning("Slow query (%.1f ms) in %s: %s", elapsed * 1000, endpoint, statement)
+
+
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    if current_app.config['PROFILE_HEADER_ENABLED'] and request.headers.get('X-Profile'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def add_server_timing(response):
+    if 'request_start_time' not in g:
+        return response
+    total_ms = (time.perf_counter() - g.request_start_time) * 1000
+    sql_ms = g.sql_time * 1000
+    response.headers.add('Server-Timing', f'app;dur={total_ms:.1f}')
+    response.headers.add('Server-Timing', f'db;dur={sql_ms:.1f};desc="{g.sql_count} queries"')
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_dir = current_app.config['PROFILE_DIR']
+        os.makedirs(profile_dir, exist_ok=True)
+        filename = f"{request.endpoint}-{int(time.time() * 1000)}.prof"
+        profiler.dump_stats(os.path.join(profile_dir, filename))
+        # open with: python -m pstats <file>, or snakeviz
+        response.headers['X-Profile-File'] = filename
+    return response
+
+
+def init_app(app):
+    # The primary and any read replicas
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(start_request_timer)
+    app.after_request(add_server_timing)
@@ -0,0 +1,66 @@
+# Prometheus metrics at GET /metrics
+# Request latency histograms, in-flight gauges and status code counters per Flask endpoint,
+# plus failed logins from basic_auth / token_auth
+#
+# Under gunicorn each worker has its own copy of the metrics. Set PROMETHEUS_MULTIPROC_DIR to an
+# empty directory and prometheus_client keeps them in files there, which /metrics adds up across
+# workers (gunicorn.conf.py clears the directory on start and cleans up after dead workers)
+
+import os
+import time
+from flask import Blueprint, g, request, Response
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', "Time spent handling requests", ['endpoint', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', "Requests being handled right now", ['endpoint'], multiprocess_mode='livesum'
+)
+RESPONSES = Counter(
+    'http_responses_total', "Responses sent by status code", ['endpoint', 'method', 'status']
+)
+AUTH_FAILURES = Counter(
+    'auth_failures_total', "Requests rejected by basic_auth or token_auth", ['scheme', 'status']
+)
+
+
+bp = Blueprint('prometheus', __name__)
+
+
+def get_endpoint():
+    # requests that don't match any route (404s) have no endpoint
+    return request.endpoint or 'unmatched'
+
+
+@bp.before_app_request
+def start_request_metrics():
+    g.metrics_start_time = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(get_endpoint()).inc()
+
+
+@bp.after_app_request
+def record_request_metrics(response):
+    if 'metrics_start_time' in g:
+        REQUEST_LATENCY.labels(get_endpoint(), request.method).observe(time.perf_counter() - g.metrics_start_time)
+        RESPONSES.labels(get_endpoint(), request.method, str(response.status_code)).inc()
+    return response
+
+
+# teardown runs even when something fails after the response is made, so the gauge always comes back down
+@bp.teardown_app_request
+def finish_request_metrics(error=None):
+    if g.pop('metrics_start_time', None) is not None:
+        REQUESTS_IN_FLIGHT.labels(get_endpoint()).dec()
+
+
+@bp.route('/metrics')
+def metrics():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,105 @@
+# flask check-query-plans
+# Runs EXPLAIN on the queries behind the busiest routes and exits with an error
+# if any of them has to read a whole table instead of using an index
+
+import json
+import re
+import sys
+from datetime import datetime, timezone
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from . import db
+from .models import Post, Comment, UserToken, POST_SUMMARY_DEFAULT_FIELDS
+from .pagination import page_statement, encode_cursor
+from .auth import user_by_username_select, token_user_select
+from .jobs import claimable_jobs_select
+from .routes import get_posts_select, get_comments_select
+from .sweeper import expired_select
+
+
+# The statements behind each hot path, built with the same helpers the routes, auth and workers use
+# so the checks follow the code, with sample values for the parameters
+def get_hot_queries():
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    next_page = {'cursor' : encode_cursor(now, 1)}
+    return {
+        "GET /posts": page_statement(get_posts_select(None, None)[0], Post, {})[0],
+        "GET /posts (next page)": page_statement(get_posts_select(None, None)[0], Post, next_page)[0],
+        "GET /posts?view=summary": page_statement(get_posts_select(POST_SUMMARY_DEFAULT_FIELDS, None)[0], Post, {})[0],
+        "GET /posts/<id> (last_modified)": db.select(Post.last_modified).where(Post.id == 1),
+        "GET /posts/<id>/comments": page_statement(get_comments_select(1), Comment, {}, descending=False)[0],
+        "GET /posts/<id>/comments (next page)": page_statement(get_comments_select(1), Comment, next_page, descending=False)[0],
+        # the lazy loads of user.posts / user.comments
+        "user.posts": db.select(Post).where(Post.user_id == 1),
+        "user.comments": db.select(Comment).where(Comment.user_id == 1),
+        "token_auth": token_user_select("abc", now),
+        "basic_auth": user_by_username_select("abc"),
+        "flask sweep-tokens": expired_select(UserToken, 1000, now),
+        "job workers": claimable_jobs_select(now),
+    }
+
+
+# Run the statement with EXPLAIN in front, SQLAlchemy compiles it and binds the parameters as usual
+def execute_with_prefix(connection, statement, prefix):
+    def add_prefix(conn, cursor, sql, parameters, context, executemany):
+        return prefix + sql, parameters
+    event.listen(connection, "before_cursor_execute", add_prefix, retval=True)
+    try:
+        return connection.execute(statement).all()
+    finally:
+        event.remove(connection, "before_cursor_execute", add_prefix)
+
+
+# Postgres plans are a tree of nodes, look for any Seq Scan in it
+def _postgres_seq_scans(plan):
+    scans = []
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append(f"Seq Scan on {plan.get('Relation Name')}")
+    for child in plan.get("Plans", []):
+        scans.extend(_postgres_seq_scans(child))
+    return scans
+
+
+def explain(connection, statement):
+    dialect = connection.dialect.name
+
+    if dialect == "postgresql":
+        # Tiny dev tables make a Seq Scan the cheapest plan even with an index, so take it off the table
+        # and see whether Postgres still has to fall back to one
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        result = execute_with_prefix(connection, statement, "EXPLAIN (FORMAT JSON) ")[0][0]
+        if isinstance(result, str):
+            result = json.loads(result)
+        return _postgres_seq_scans(result[0]["Plan"])
+
+    if dialect == "sqlite":
+        rows = execute_with_prefix(connection, statement, "EXPLAIN QUERY PLAN ")
+        # "SCAN post" is a full table scan, "SEARCH post USING INDEX ..." and "SCAN post USING INDEX ..." are not
+        return [row[-1] for row in rows if re.match(r"SCAN \w+$", row[-1])]
+
+    raise RuntimeError(f"Query plan checks are not supported on {dialect}")
+
+
+def check_query_plans():
+    failures = {}
+    with db.engine.connect() as connection:
+        for name, statement in get_hot_queries().items():
+            with connection.begin():
+                scans = explain(connection, statement)
+            if scans:
+                failures[name] = scans
+    return failures
+
+
+@click.command("check-query-plans")
+@with_appcontext
+def check_query_plans_command():
+    failures = check_query_plans()
+    for name in get_hot_queries():
+        if name in failures:
+            print(f"FAIL  {name}: {', '.join(failures[name])}")
+        else:
+            print(f"ok    {name}")
+    if failures:
+        sys.exit(1)
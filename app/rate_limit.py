@@ -0,0 +1,168 @@
+# Token bucket rate limiting for the expensive endpoints (budgets are RATE_LIMITS in config.py)
+# Every client gets a bucket per budget that holds up to <requests> tokens and refills at
+# <requests> per <period>. Each request takes a token, and when the bucket is empty the request
+# is turned away with a 429 and a Retry-After saying when the next token will be there
+# RATE_LIMIT_BACKEND picks where the buckets live:
+#   "none"       rate limiting off
+#   "memory"     in each worker
+#   "redis"      shared by every worker through the Redis server at REDIS_URL (needs the redis package)
+#   "redis-stub" stands in for Redis inside this process, for tests and local runs
+
+import math
+import threading
+import time
+from functools import wraps
+from flask import request, current_app
+from .auth import token_auth
+from .cache import TTLCache
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+PERIODS = {'second' : 1, 'minute' : 60, 'hour' : 3600, 'day' : 86400}
+
+
+# "10/minute" -> (10, 60)
+def parse_limit(limit):
+    try:
+        requests, period = limit.split('/')
+        return int(requests), PERIODS[period.strip()]
+    except (ValueError, KeyError):
+        raise ValueError(f"Invalid rate limit {limit!r}, use <requests>/<second|minute|hour|day>")
+
+
+# One step of the token bucket, state is (tokens, updated_at) or None for a new (full) bucket
+# Returns the new state and how many seconds until the request could go ahead (0 means now)
+def take_token(state, now, capacity, period):
+    rate = capacity / period
+    tokens, updated_at = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + max(0, now - updated_at) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class MemoryBackend:
+    def __init__(self, max_size):
+        # an idle bucket is full again after one period, so it is dropped then (see hit)
+        self._buckets = TTLCache(max_size, max(PERIODS.values()))
+        self._lock = threading.Lock()
+
+    def hit(self, key, capacity, period):
+        with self._lock:
+            state, retry_after = take_token(self._buckets.get(key), time.monotonic(), capacity, period)
+            self._buckets.set(key, state, expires_in=period)
+        return retry_after
+
+
+# The same steps as take_token, run inside Redis so workers can't race on a bucket
+TAKE_TOKEN_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local rate = capacity / period
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], period)
+return tostring(retry_after)
+"""
+
+
+class RedisBackend:
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("The redis package must be installed to use RATE_LIMIT_BACKEND = 'redis'")
+        self._take_token = redis.Redis.from_url(url).register_script(TAKE_TOKEN_SCRIPT)
+
+    def hit(self, key, capacity, period):
+        return float(self._take_token(keys=[key], args=[capacity, period, time.time()]))
+
+
+# Behaves like RedisBackend (one set of buckets for every app in the process, wall clock time)
+class RedisStubBackend:
+    _buckets = {}
+    _lock = threading.Lock()
+
+    def hit(self, key, capacity, period):
+        with self._lock:
+            self._buckets[key], retry_after = take_token(self._buckets.get(key), time.time(), capacity, period)
+        return retry_after
+
+
+def create_backend(config):
+    backend_name = config['RATE_LIMIT_BACKEND']
+    if backend_name == 'memory':
+        return MemoryBackend(config['RATE_LIMIT_CACHE_SIZE'])
+    if backend_name == 'redis':
+        return RedisBackend(config['REDIS_URL'])
+    if backend_name == 'redis-stub':
+        return RedisStubBackend()
+    if backend_name == 'none':
+        return None
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND {backend_name!r}")
+
+
+def init_app(app):
+    # an empty budget means no limit for that endpoint
+    app.extensions['rate_limits'] = {name : parse_limit(limit) for name, limit in app.config['RATE_LIMITS'].items() if limit}
+    app.extensions['rate_limiter'] = create_backend(app.config)
+
+
+# The client's IP address when PROXY_FIX_X_FOR proxies sit in front of the app: the entry the
+# last trusted proxy added to X-Forwarded-For, the same one ProxyFix picks for the Flask routes
+# (for those remote_addr has already been fixed, the async routes in asgi.py call this themselves)
+def get_client_ip(remote_addr, forwarded_for, trusted_proxies):
+    if trusted_proxies and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        if len(addresses) >= trusted_proxies:
+            return addresses[-trusted_proxies]
+    return remote_addr
+
+
+# The logged in user when token_auth has already run, otherwise the IP address
+def get_client_key():
+    user = token_auth.current_user()
+    if user is not None:
+        return f"user:{user.id}"
+    return f"ip:{request.remote_addr}"
+
+
+# Returns how many seconds the client has to wait, 0 if the request can go ahead
+def check_rate_limit(budget, client_key):
+    limiter = current_app.extensions['rate_limiter']
+    limit = current_app.extensions['rate_limits'].get(budget)
+    if limiter is None or limit is None:
+        return 0
+    capacity, period = limit
+    return limiter.hit(f"ratelimit:{budget}:{client_key}", capacity, period)
+
+
+def rate_limit_error(retry_after):
+    retry_after = max(1, math.ceil(retry_after))
+    return {'error' : f"Too many requests, please try again in {retry_after} seconds"}, 429, {'Retry-After' : str(retry_after)}
+
+
+# Decorator for views, only_if can limit just some requests (e.g. only searches)
+# Put it under @token_auth.login_required to key the bucket on the user instead of the IP
+def rate_limit(budget, only_if=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if only_if is None or only_if():
+                retry_after = check_rate_limit(budget, get_client_key())
+                if retry_after:
+                    return rate_limit_error(retry_after)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
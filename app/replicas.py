@@ -0,0 +1,73 @@
+# Read replica routing
+# Views marked with @read_replica run their SELECTs against one of the replicas in
+# DATABASE_REPLICA_URLS. Everything else (token auth, writes, flushes) stays on the primary.
+# After a client writes, its reads go to the primary for REPLICA_STICKY_SECONDS so it sees
+# its own changes even if the replicas are behind
+
+import random
+import time
+from functools import wraps
+from flask import g, request, has_app_context, current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Insert, Update, Delete
+from .cache import TTLCache
+
+STICKY_COOKIE = 'read_primary_until'
+
+
+def get_replica_keys(config):
+    return [key for key in config.get('SQLALCHEMY_BINDS') or {} if key.startswith('replica_')]
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and has_app_context() and g.get('use_replica')
+                and not self._flushing and not isinstance(clause, (Insert, Update, Delete))):
+            replica_keys = get_replica_keys(current_app.config)
+            if replica_keys:
+                # stay on one replica for the whole request
+                if 'replica_key' not in g:
+                    g.replica_key = random.choice(replica_keys)
+                return self._db.engines[g.replica_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def get_token_key():
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        return authorization[len('Bearer '):]
+    return None
+
+
+def must_read_primary():
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    token_key = get_token_key()
+    return token_key is not None and current_app.extensions['recent_writers'].get(token_key) is not None
+
+
+def read_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = not must_read_primary()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_app(app):
+    sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+    # Tokens that wrote recently, for clients that don't keep cookies (per worker)
+    recent_writers = TTLCache(app.config['REPLICA_STICKY_CACHE_SIZE'], sticky_seconds)
+    app.extensions['recent_writers'] = recent_writers
+
+    @app.after_request
+    def remember_writes(response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and get_replica_keys(app.config):
+            response.set_cookie(STICKY_COOKIE, str(time.time() + sticky_seconds), max_age=sticky_seconds, httponly=True)
+            token_key = get_token_key()
+            if token_key is not None:
+                recent_writers.set(token_key, True)
+        return response
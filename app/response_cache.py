@@ -0,0 +1,227 @@
+# Cache for the JSON responses of the post read endpoints
+# RESPONSE_CACHE_BACKEND picks where entries live:
+#   "none"       caching off
+#   "memory"     LRU inside each worker (writes through one worker only invalidate that worker's copy,
+#                other workers catch up within RESPONSE_CACHE_TTL)
+#   "redis"      shared by every worker through the Redis server at REDIS_URL (needs the redis package)
+#   "redis-stub" stands in for Redis inside this process, for tests and local runs
+#
+# Keys carry generation numbers instead of being deleted one by one: a write bumps the
+# generation of what it touched and every key built from the old number is never read again
+
+import json
+import logging
+import threading
+import time
+from functools import wraps
+from flask import request, make_response, g, has_request_context, current_app
+from sqlalchemy import event, inspect
+from .cache import TTLCache
+from .models import User
+from .replicas import get_replica_keys, must_read_primary
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    def __init__(self, max_size, ttl):
+        self._entries = TTLCache(max_size, ttl)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        return [self._generations.get(key) if key.startswith('gen:') else self._entries.get(key) for key in keys]
+
+    def set(self, key, value, ttl):
+        self._entries.set(key, value, expires_in=ttl)
+
+    def incr(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+
+# When Redis can't be reached the requests carry on without the cache: reads are misses and
+# writes are skipped (entries that missed a generation bump still expire after RESPONSE_CACHE_TTL)
+class RedisBackend:
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("The redis package must be installed to use RESPONSE_CACHE_BACKEND = 'redis'")
+        self._client = redis.Redis.from_url(url)
+
+    def get_many(self, keys):
+        try:
+            return self._client.mget(keys)
+        except redis.RedisError:
+            logger.warning("Response cache read failed, serving without the cache", exc_info=True)
+            return [None] * len(keys)
+
+    def set(self, key, value, ttl):
+        try:
+            self._client.set(key, value, ex=ttl)
+        except redis.RedisError:
+            logger.warning("Response cache write failed for %s", key, exc_info=True)
+
+    def incr(self, key):
+        try:
+            self._client.incr(key)
+        except redis.RedisError:
+            logger.warning("Response cache invalidation failed for %s", key, exc_info=True)
+
+
+# Behaves like RedisBackend (bytes in, bytes out, no size limit) with a dict shared by the whole process
+class RedisStubBackend:
+    _store = {}
+    _lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            values = []
+            for key in keys:
+                value, expires_at = self._store.get(key, (None, None))
+                values.append(value if expires_at is None or expires_at > now else None)
+            return values
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._store[key] = (value, time.monotonic() + ttl)
+
+    def incr(self, key):
+        with self._lock:
+            value, expires_at = self._store.get(key, (b'0', None))
+            self._store[key] = (str(int(value) + 1).encode(), expires_at)
+
+
+def create_backend(config):
+    backend_name = config['RESPONSE_CACHE_BACKEND']
+    if backend_name == 'memory':
+        return MemoryBackend(config['RESPONSE_CACHE_SIZE'], config['RESPONSE_CACHE_TTL'])
+    if backend_name == 'redis':
+        return RedisBackend(config['REDIS_URL'])
+    if backend_name == 'redis-stub':
+        return RedisStubBackend()
+    if backend_name == 'none':
+        return None
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND {backend_name!r}")
+
+
+def get_backend():
+    return current_app.extensions['response_cache']
+
+
+# The generations a cached response depends on
+# Every entry depends on "all" (bumped by user profile changes, which show up in every author dict)
+def get_generation_keys(endpoint, view_args):
+    generation_keys = ['gen:all']
+    if 'post_id' in view_args:
+        generation_keys.append(f"gen:post:{view_args['post_id']}")
+    else:
+        generation_keys.append(f"gen:{endpoint}")
+    return generation_keys
+
+
+def get_cache_key(endpoint, view_args, generations):
+    args = '&'.join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    path_args = ','.join(f"{key}={value}" for key, value in sorted(view_args.items()))
+    generation = '.'.join(str(int(value or 0)) for value in generations)
+    return f"response:{endpoint}:{path_args}:{args}:{generation}"
+
+
+# Decorator for GET views whose response only depends on the URL
+def cached_response(view):
+    @wraps(view)
+    def wrapper(**view_args):
+        backend = get_backend()
+        if backend is None:
+            return view(**view_args)
+
+        # the view's own name, so the keys don't depend on the blueprint it is registered on
+        generation_keys = get_generation_keys(view.__name__, view_args)
+        generations = backend.get_many(generation_keys)
+        key = get_cache_key(view.__name__, view_args, generations)
+
+        # A client that just wrote reads from the primary (see replicas.py), and a cached page
+        # could be older than its write, so it skips the lookup
+        reads_primary = bool(get_replica_keys(current_app.config)) and must_read_primary()
+        cached = None if reads_primary else backend.get_many([key])[0]
+        if cached is not None:
+            entry = json.loads(cached)
+            response = make_response(entry['body'], entry['status'], entry['headers'])
+            response.headers['X-Cache'] = 'HIT'
+            # answer If-None-Match / If-Modified-Since from the cached ETag and Last-Modified
+            # (listings are cached without a Last-Modified, so only their ETag counts)
+            return response.make_conditional(request)
+
+        response = make_response(view(**view_args))
+        # streamed responses would have to be read into memory to be cached, and a replica can be
+        # behind the generation in the key, so only pages read from the primary are stored
+        if response.status_code == 200 and not response.is_streamed and 'replica_key' not in g:
+            entry = {
+                'body' : response.get_data(as_text=True),
+                'status' : response.status_code,
+                'headers' : {name : value for name, value in response.headers.items() if name in ('Content-Type', 'ETag', 'Last-Modified')}
+            }
+            backend.set(key, json.dumps(entry), current_app.config['RESPONSE_CACHE_TTL'])
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+# Invalidations wait until the end of the request so they happen after the commit
+# (otherwise another request could cache the old data again in between), but before the
+# response goes out, so a client that got its 201 never reads the old page afterwards
+def invalidate(*generation_keys):
+    backend = get_backend()
+    if backend is None:
+        return
+    if has_request_context():
+        g.setdefault('cache_invalidations', set()).update(generation_keys)
+    else:
+        for generation_key in generation_keys:
+            backend.incr(generation_key)
+
+
+def apply_invalidations():
+    for generation_key in g.pop('cache_invalidations', ()):
+        get_backend().incr(generation_key)
+
+
+# Registered before models.commit_unit_of_work (see create_app) so it runs after it,
+# after_request hooks run in the reverse order they were added
+def apply_invalidations_after_request(response):
+    apply_invalidations()
+    return response
+
+
+# When the view raised, after_request hooks don't run, but writes it committed before that still count
+def apply_leftover_invalidations(error=None):
+    apply_invalidations()
+
+
+def init_app(app):
+    app.extensions['response_cache'] = create_backend(app.config)
+    app.after_request(apply_invalidations_after_request)
+    app.teardown_request(apply_leftover_invalidations)
+
+
+# A new or removed post changes the listings
+def invalidate_posts():
+    invalidate('gen:get_posts')
+
+
+# An edited post (or a new or removed comment, through commentCount) changes its own page and the listings
+def invalidate_post(post_id):
+    invalidate(f"gen:post:{post_id}", 'gen:get_posts')
+
+
+# Users are embedded as the author of posts and comments everywhere
+@event.listens_for(User, 'after_update')
+def invalidate_user_profile(mapper, connection, user):
+    state = inspect(user)
+    if any(state.attrs[key].history.has_changes() for key in ('first_name', 'last_name', 'username', 'email')):
+        invalidate('gen:all')
@@ -1,10 +1,25 @@
-from flask import request, render_template
-from . import app, db
-from .models import User, Post, Comment
+from flask import Blueprint, request, render_template, current_app
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import User, UserToken, Post, Comment, save_changes, post_loader_options, POST_SUMMARY_FIELDS, POST_SUMMARY_DEFAULT_FIELDS, post_summary_select, post_summary_to_dict
 from .auth import basic_auth, token_auth
+from .pagination import paginate, paginate_ranked, PaginationError
+from .search import search_posts
+from .tokens import issue_signed_token, revoke_signed_token
+from .cache import token_cache
+from .hashing import password_hasher
+from .pool_metrics import pool_metrics
+from .conditional import get_validators, is_not_modified, not_modified_response, conditional_response
+from .response_cache import cached_response, invalidate_posts, invalidate_post
+from .streaming import stream_json_list
+from .replicas import read_replica
+from .rate_limit import rate_limit
 
+# registered on the app in create_app
+bp = Blueprint('api', __name__)
 
-@app.route("/")
+
+@bp.route("/")
 def index():
     return render_template("index.html")
 
@@ -12,7 +27,8 @@ def index():
 # User Endpoints
 
 # Create new user endpoint
-@app.route("/users", methods=["POST"])
+@bp.route("/users", methods=["POST"])
+@rate_limit('create_user')
 def create_user():
     # check to make sure that the request is JSON
     if not request.is_json:
@@ -24,7 +40,7 @@ def create_user():
     required_fields = ["firstName", "lastName", "username", "email", "password"]
     missing_fields = []
     for field in required_fields:
-        if field not in data:
+        if data.get(field) is None:
             missing_fields.append(field)
     if missing_fields:
         return {"error" : f"{', '.join(missing_fields)} must be in the request body"}, 400
@@ -36,28 +52,57 @@ def create_user():
     email = data.get('email')
     password = data.get('password')
 
-    # Check to see if any current users already have that username or email
-    # db.session.get(User, 6) <-- will retrieve user with id of 6
-    check_users = db.session.execute(db.select(User).where( (User.username == username) | (User.email == email) )).scalars().all()
-    # Executing a SELECT * FROM user WHERE username = username OR email = email;
-    if check_users:
-        return {'error' : "A user with that username and/or email already exists"}, 400
-    
     # Create a new instance of user with the data from the request
     new_user = User(first_name=first_name, last_name=last_name,  username=username, email=email, password=password)
+    db.session.add(new_user)
+
+    # Insert straight away and let the unique indexes on username and email (any case) turn
+    # duplicates away. Checking with a SELECT first costs another query and two people
+    # signing up at the same moment could both pass it
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return {'error' : "A user with that username and/or email already exists"}, 400
 
-    # Convert User object to a dictionary to display
-    return new_user.to_dict(), 201
+    # Convert User object to a dictionary to display (before the commit, which would expire it)
+    user_dict = new_user.to_dict()
+    save_changes()
+    return user_dict, 201
 
 
-@app.route('/token')
+@bp.route('/token')
+@rate_limit('get_token')
 @basic_auth.login_required
 def get_token():
     user = basic_auth.current_user()
+    if current_app.config['TOKEN_MODE'] == 'signed':
+        return issue_signed_token(user)
     return user.get_token()
 
 
-@app.route("/test")
+# Log out the token used for this request
+@bp.route('/token', methods=['DELETE'])
+@token_auth.login_required
+def revoke_token():
+    if current_app.config['TOKEN_MODE'] == 'signed':
+        revoke_signed_token(token_auth.get_auth().token)
+    else:
+        UserToken.revoke(token_auth.get_auth().token)
+    return {'success' : "Token has been revoked"}, 200
+
+
+# Counters for this worker's caches and pools (Prometheus metrics are at /metrics)
+@bp.route('/metrics/worker')
+def worker_metrics():
+    return {
+        'tokenCache' : token_cache.stats(),
+        'passwordHashing' : password_hasher.stats(),
+        'connectionPool' : pool_metrics.stats(db.engine.pool)
+    }
+
+
+@bp.route("/test")
 def test():
     my_dicts = []
     for i in range(1,10):
@@ -69,30 +114,108 @@ def test():
         my_dicts.append(a_dict)
     return my_dicts
 
-# Get all posts / search for title match
-@app.route('/posts')
-def get_posts():
-    search = request.args.get('search')
-    select_stmt = db.select(Post)
+# Which fields GET /posts should return, None for the full post dicts
+def get_post_fields(args):
+    if args.get('fields'):
+        fields = args.get('fields').split(',')
+        unknown_fields = [field for field in fields if field not in POST_SUMMARY_FIELDS]
+        if unknown_fields:
+            raise ValueError(f"Unknown fields: {', '.join(unknown_fields)}")
+        return fields
+    if args.get('view') == 'summary':
+        return POST_SUMMARY_DEFAULT_FIELDS
+    return None
+
+
+# The select behind GET /posts, and whether it is ordered by search rank
+def get_posts_select(fields, search):
+    if fields:
+        select_stmt = post_summary_select(fields)
+    else:
+        # Load the authors up front so to_dict() doesn't run a query per post
+        select_stmt = db.select(Post).options(*post_loader_options())
+    ranked = False
     if search:
-        select_stmt = select_stmt.where(Post.title.ilike('%' + search + '%'))
-    # Get the posts from the database
-    posts = db.session.execute(select_stmt).scalars().all()
-    # return a list of dictionaries 
-    return [p.to_dict() for p in posts], 200
+        select_stmt, ranked = search_posts(select_stmt, search)
+    return select_stmt, ranked
+
+
+# Get all posts / full-text search on title and body
+# Newest first (or best match first when searching), one page at a time: ?limit=20&cursor=<next from the previous page>
+# ?view=summary or ?fields=title,commentCount,... returns just those fields, read straight from the columns
+# ?stream=true sends every matching post (no limit or cursor) as it is read instead of one page
+@bp.route('/posts')
+@cached_response
+@rate_limit('search', only_if=lambda: 'search' in request.args)
+@read_replica
+def get_posts():
+    try:
+        fields = get_post_fields(request.args)
+    except ValueError as e:
+        return {'error' : str(e)}, 400
+    select_stmt, ranked = get_posts_select(fields, request.args.get('search'))
+
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        if not ranked:
+            select_stmt = select_stmt.order_by(Post.date_created.desc(), Post.id.desc())
+        if fields:
+            return stream_json_list('posts', select_stmt, lambda p: post_summary_to_dict(p, fields), scalars=False)
+        return stream_json_list('posts', select_stmt, lambda p: p.to_dict())
+
+    # Get one page of posts from the database
+    try:
+        if ranked:
+            posts, next_cursor = paginate_ranked(select_stmt, request.args, scalars=not fields)
+        else:
+            posts, next_cursor = paginate(select_stmt, Post, request.args, scalars=not fields)
+    except PaginationError as e:
+        return {'error' : str(e)}, 400
+    # Nothing on this page changed since the client's copy, skip building the response
+    # Only the ETag (which covers the ids) is used: a post deleted from the page leaves the newest
+    # last_modified where it was, so Last-Modified / If-Modified-Since would miss it
+    etag, _ = get_validators([(p.id, p.last_modified) for p in posts], extra=(next_cursor, fields))
+    if is_not_modified(etag, None):
+        return not_modified_response(etag, None)
+    # return a list of dictionaries plus the cursor for the next page
+    if fields:
+        post_dicts = [post_summary_to_dict(p, fields) for p in posts]
+    else:
+        post_dicts = [p.to_dict() for p in posts]
+    return conditional_response(({
+        'posts' : post_dicts,
+        'next' : next_cursor
+    }, 200), etag, None)
+
+# The comments on a post in thread order (oldest first), with their authors loaded up front
+def get_comments_select(post_id):
+    return db.select(Comment).where(Comment.post_id == post_id).options(db.selectinload(Comment.user))
+
 
 # Get single post by id
-@app.route('/posts/<int:post_id>')
+@bp.route('/posts/<int:post_id>')
+@cached_response
+@read_replica
 def get_post(post_id):
+    # Check the client's cached copy against last_modified (bumped by new comments too) before loading anything
+    last_modified = db.session.execute(db.select(Post.last_modified).where(Post.id == post_id)).scalar_one_or_none()
+    if last_modified is not None:
+        etag, last_modified = get_validators([(post_id, last_modified)])
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
     # Get either a Post of post_id or None
-    post = db.session.get(Post, post_id)
+    post = db.session.get(Post, post_id, options=post_loader_options())
     if post: 
-        return post.to_dict()
+        # Only the first page of comments, the rest are at GET /posts/<id>/comments?cursor=<commentsNext>
+        comments, next_cursor = paginate(get_comments_select(post.id), Comment, {}, descending=False)
+        post_dict = post.to_dict()
+        post_dict['comments'] = [c.to_dict() for c in comments]
+        post_dict['commentsNext'] = next_cursor
+        return conditional_response(post_dict, etag, last_modified)
     # If we loop through and can't find any such post we get an error:
     return {'error': f"Post with an ID of {post_id} does not exist"}, 404
 
 # Create a post
-@app.route('/posts', methods=['POST'])
+@bp.route('/posts', methods=['POST'])
 @token_auth.login_required
 def create_posts():
     # Check if the request body is JSON
@@ -117,13 +240,84 @@ def create_posts():
 
     # Create a new Post instance with data and adding to db (hard coded user_id for now)
     new_post = Post(title=title, body=body, user_id=current_user.id)
+    invalidate_posts()
 
     # Return the newly created Post as a dictionary with 201 status code
     return new_post.to_dict(), 201
 
 
+# Check every item of a bulk request in one pass
+# Returns the items that passed and a result entry (with its index in the request) for each one
+def validate_bulk_items(items, required_fields):
+    valid_items = []
+    results = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index' : index, 'error' : "Each item must be a JSON object"})
+            continue
+        missing_fields = [field for field in required_fields if field not in item]
+        if missing_fields:
+            results.append({'index' : index, 'error' : f"{', '.join(missing_fields)} must be in the item"})
+            continue
+        # a null would fail the NOT NULL constraint and take the whole INSERT (every item) down with it
+        invalid_fields = [field for field in required_fields if not isinstance(item[field], str)]
+        if invalid_fields:
+            results.append({'index' : index, 'error' : f"{', '.join(invalid_fields)} must be a string"})
+            continue
+        valid_items.append(item)
+        results.append({'index' : index})
+    return valid_items, results
+
+
+# Fill in the new ids and pick the status: 201 all created, 207 some failed, 400 none created
+def bulk_response(results, new_ids):
+    new_ids = iter(new_ids)
+    for result in results:
+        if 'error' not in result:
+            result['id'] = next(new_ids)
+    created = sum(1 for result in results if 'id' in result)
+    if created == len(results):
+        status_code = 201
+    elif created:
+        status_code = 207
+    else:
+        status_code = 400
+    return {'results' : results}, status_code
+
+
+# Check that a bulk request body is a JSON array within the size limit
+def get_bulk_items():
+    if not request.is_json:
+        return None, ({'error' : "Your content-type must be application/json"}, 400)
+    items = request.json
+    if not isinstance(items, list) or not items:
+        return None, ({'error' : "The request body must be a non-empty array"}, 400)
+    max_items = current_app.config['BULK_MAX_ITEMS']
+    if len(items) > max_items:
+        return None, ({'error' : f"No more than {max_items} items can be created at once"}, 413)
+    return items, None
+
+
+# Create many posts at once
+@bp.route('/posts/bulk', methods=['POST'])
+@token_auth.login_required
+@rate_limit('bulk')
+def create_posts_bulk():
+    items, error = get_bulk_items()
+    if error:
+        return error
+
+    valid_items, results = validate_bulk_items(items, ["title", "body"])
+    current_user = token_auth.current_user()
+    rows = [{'title' : item.get('title'), 'body' : item.get('body'), 'user_id' : current_user.id} for item in valid_items]
+    new_ids = Post.bulk_insert(rows)
+    invalidate_posts()
+
+    return bulk_response(results, new_ids)
+
+
 # Update a post
-@app.route('/posts/<int:post_id>', methods=["PUT"]) # PUT request to update
+@bp.route('/posts/<int:post_id>', methods=["PUT"]) # PUT request to update
 @token_auth.login_required
 def edit_post(post_id):
     # check to see that they have a JSON body
@@ -141,11 +335,12 @@ def edit_post(post_id):
     # Able to edit, check their json and edit the post
     data = request.json
     post.update(**data) # use of **unpacks data into kwargs
+    invalidate_post(post.id)
 
     return post.to_dict()
 
 # Delete Post
-@app.route('/posts/<int:post_id>', methods=["DELETE"])
+@bp.route('/posts/<int:post_id>', methods=["DELETE"])
 @token_auth.login_required
 def delete_post(post_id):
     post = db.session.get(Post, post_id)
@@ -158,12 +353,29 @@ def delete_post(post_id):
     
     #delete the post
     post.delete()
+    invalidate_post(post_id)
     return {'success' : f"{post.title} was successfully deleted"}, 200
 
 # Comment Endpoints
 
+# Get the comments on a post, oldest first, one page at a time
+@bp.route('/posts/<int:post_id>/comments')
+@read_replica
+def get_comments(post_id):
+    post = db.session.get(Post, post_id)
+    if post is None:
+        return {'error' : f'Post with an id #{post_id} does not exist'}, 404
+    try:
+        comments, next_cursor = paginate(get_comments_select(post.id), Comment, request.args, descending=False)
+    except PaginationError as e:
+        return {'error' : str(e)}, 400
+    return {
+        'comments' : [c.to_dict() for c in comments],
+        'next' : next_cursor
+    }, 200
+
 # Create a comment
-@app.route('/posts/<int:post_id>/comments', methods=["POST"])
+@bp.route('/posts/<int:post_id>/comments', methods=["POST"])
 @token_auth.login_required
 def create_comment(post_id):
     if not request.is_json:
@@ -189,11 +401,33 @@ def create_comment(post_id):
     current_user = token_auth.current_user()
 
     new_comment = Comment(body=body, user_id=current_user.id, post_id=post.id)
+    invalidate_post(post.id)
 
     return new_comment.to_dict(), 201
 
+# Create many comments on a post at once
+@bp.route('/posts/<int:post_id>/comments/bulk', methods=["POST"])
+@token_auth.login_required
+@rate_limit('bulk')
+def create_comments_bulk(post_id):
+    items, error = get_bulk_items()
+    if error:
+        return error
+
+    post = db.session.get(Post, post_id)
+    if post is None:
+        return {'error' : f'Post with an id #{post_id} does not exist'}, 404
+
+    valid_items, results = validate_bulk_items(items, ["body"])
+    current_user = token_auth.current_user()
+    rows = [{'body' : item.get('body'), 'user_id' : current_user.id, 'post_id' : post.id} for item in valid_items]
+    new_ids = Comment.bulk_insert(rows)
+    invalidate_post(post.id)
+
+    return bulk_response(results, new_ids)
+
 # Delete a comment
-@app.route('/posts/<int:post_id>/comments/<int:comment_id>', methods=["DELETE"])
+@bp.route('/posts/<int:post_id>/comments/<int:comment_id>', methods=["DELETE"])
 @token_auth.login_required
 def delete_comment(post_id, comment_id):
     post = db.session.get(Post, post_id)
@@ -211,4 +445,5 @@ def delete_comment(post_id, comment_id):
     
     #delete the post
     comment.delete()
+    invalidate_post(post.id)
     return {'success' : f"Comment #{comment.id} was successfully deleted"}, 200
\ No newline at end of file
@@ -0,0 +1,91 @@
+# Full-text search over post titles and bodies
+# Postgres: generated tsvector column post.search_vector with a GIN index (see the migration)
+# SQLite: an FTS5 virtual table post_fts kept in sync with triggers
+# Anything else (or an SQLite database without post_fts) falls back to ILIKE on title and body
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect
+from . import db
+from .models import Post
+
+
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(title, body, content='post', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_ai AFTER INSERT ON post BEGIN
+        INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_ad AFTER DELETE ON post BEGIN
+        INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_au AFTER UPDATE OF title, body ON post BEGIN
+        INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    "INSERT INTO post_fts(post_fts) VALUES ('rebuild')",
+]
+
+# Remember per database whether post_fts exists so we only inspect the schema once
+_has_sqlite_fts = {}
+
+
+# Create (or rebuild) the SQLite FTS table for databases that were made with db.create_all()
+def create_sqlite_fts():
+    with db.engine.begin() as connection:
+        for statement in SQLITE_FTS_DDL:
+            connection.exec_driver_sql(statement)
+    _has_sqlite_fts[str(db.engine.url)] = True
+
+
+# flask create-search-index
+@click.command('create-search-index')
+@with_appcontext
+def create_search_index_command():
+    if db.engine.dialect.name != 'sqlite':
+        print("Only needed for SQLite, Postgres gets its search index from the migrations")
+        return
+    create_sqlite_fts()
+    print("Search index created")
+
+
+def sqlite_fts_available():
+    url = str(db.engine.url)
+    if url not in _has_sqlite_fts:
+        _has_sqlite_fts[url] = inspect(db.engine).has_table('post_fts')
+    return _has_sqlite_fts[url]
+
+
+# FTS5 treats characters like - " * : as query syntax, so quote every word
+# Words are ANDed together, the same as plainto_tsquery does on Postgres
+def sqlite_match_query(search):
+    words = search.split()
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+# Add the search condition and ranking to a select on Post
+# Returns the new statement and whether it is ordered by rank (best match first)
+def search_posts(select_stmt, search):
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        search_vector = db.literal_column('post.search_vector')
+        query = db.func.plainto_tsquery('english', search)
+        rank = db.func.ts_rank(search_vector, query)
+        select_stmt = select_stmt.where(search_vector.op('@@')(query)).order_by(rank.desc(), Post.id.desc())
+        return select_stmt, True
+
+    if dialect == 'sqlite' and sqlite_fts_available():
+        match_query = sqlite_match_query(search)
+        if not match_query:
+            return select_stmt, False
+        matches = db.text(
+            "SELECT rowid AS post_id, bm25(post_fts, 10.0, 1.0) AS rank FROM post_fts WHERE post_fts MATCH :query"
+        ).bindparams(query=match_query).columns(post_id=db.Integer, rank=db.Float).subquery()
+        # Title matches count for more than body matches
+        # bm25() scores are negative, the lower the better
+        select_stmt = select_stmt.join(matches, matches.c.post_id == Post.id).order_by(matches.c.rank.asc(), Post.id.desc())
+        return select_stmt, True
+
+    pattern = '%' + search + '%'
+    select_stmt = select_stmt.where(Post.title.ilike(pattern) | Post.body.ilike(pattern))
+    return select_stmt, False
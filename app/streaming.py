@@ -0,0 +1,25 @@
+# Streaming JSON for large listings
+# Rows are read from the database in batches (yield_per, a server-side cursor on Postgres)
+# and written out one at a time, so memory stays flat no matter how many rows there are
+
+from flask import Response, current_app, stream_with_context
+from . import db
+
+
+# Run select_stmt and stream {"<key>": [...], "next": null} built with to_dict for each row
+def stream_json_list(key, select_stmt, to_dict, scalars=True):
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+
+    def generate():
+        result = db.session.execute(select_stmt.execution_options(yield_per=batch_size))
+        rows = result.scalars() if scalars else result
+        yield '{"' + key + '": ['
+        first = True
+        for row in rows:
+            if not first:
+                yield ','
+            yield current_app.json.dumps(to_dict(row))
+            first = False
+        yield '], "next": null}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,56 @@
+# flask sweep-tokens
+# Deletes expired login sessions (user_token) and expired logged out signed tokens (revoked_token)
+# TOKEN_SWEEP_BATCH_SIZE rows per statement, each batch in its own transaction, so a big backlog
+# never turns into one long lock on the table
+# Run it from cron, or keep it running with --interval <seconds>
+
+import time
+from datetime import datetime, timezone
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from . import db
+from .models import UserToken, RevokedToken
+
+
+# One batch of expired rows, by primary key
+def expired_select(model, batch_size, now):
+    primary_key = model.__mapper__.primary_key[0]
+    return db.select(primary_key).where(model.expires_at <= now).limit(batch_size)
+
+
+# Returns how many rows were deleted
+def sweep_expired(model, batch_size, now=None):
+    now = now or datetime.now(timezone.utc)
+    primary_key = model.__mapper__.primary_key[0]
+    deleted = 0
+    while True:
+        expired = expired_select(model, batch_size, now)
+        result = db.session.execute(
+            db.delete(model).where(primary_key.in_(expired.scalar_subquery())),
+            execution_options={'synchronize_session' : False}
+        )
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+def sweep_tokens():
+    batch_size = current_app.config['TOKEN_SWEEP_BATCH_SIZE']
+    return {
+        'user_token' : sweep_expired(UserToken, batch_size),
+        'revoked_token' : sweep_expired(RevokedToken, batch_size),
+    }
+
+
+@click.command('sweep-tokens')
+@click.option('--interval', type=float, help="Keep running and sweep every this many seconds")
+@with_appcontext
+def sweep_tokens_command(interval):
+    while True:
+        deleted = sweep_tokens()
+        print(', '.join(f"{table}: {count} deleted" for table, count in deleted.items()))
+        if not interval:
+            return
+        time.sleep(interval)
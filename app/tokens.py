@@ -0,0 +1,90 @@
+# Stateless signed tokens (TOKEN_MODE = "signed")
+# The token itself carries the user id and expiry and is signed with SECRET_KEY,
+# so checking it is a signature check instead of a database lookup
+
+import secrets
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+from . import db
+from .models import RevokedToken, as_utc
+
+
+def get_serializer():
+    secret_key = current_app.config.get('SECRET_KEY')
+    if not secret_key:
+        raise RuntimeError("SECRET_KEY must be set to use signed tokens")
+    return URLSafeSerializer(secret_key, salt='auth-token')
+
+
+# Same shape as User.get_token() returns for a new token
+def issue_signed_token(user):
+    expiration = datetime.now(timezone.utc) + timedelta(seconds=current_app.config['TOKEN_LIFETIME'])
+    token = get_serializer().dumps({
+        'sub' : user.id,
+        'exp' : int(expiration.timestamp()),
+        # unique id so a single token can be revoked
+        'jti' : secrets.token_hex(8)
+    })
+    return {
+        "token" : token,
+        "tokenExpiration" : expiration
+    }
+
+
+def decode_signed_token(token):
+    try:
+        payload = get_serializer().loads(token)
+    except BadSignature:
+        return None
+    if not isinstance(payload, dict) or payload.get('exp', 0) <= time.time():
+        return None
+    return payload
+
+
+# Each worker keeps the unexpired revoked ids in memory and reloads them every
+# TOKEN_REVOCATION_REFRESH seconds, so revocation costs one query per interval instead of one per request
+class RevocationList:
+    def __init__(self):
+        self._revoked = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        now = datetime.now(timezone.utc)
+        rows = db.session.execute(db.select(RevokedToken).where(RevokedToken.expires_at > now)).scalars().all()
+        with self._lock:
+            self._revoked = {row.jti : as_utc(row.expires_at).timestamp() for row in rows}
+            self._loaded_at = time.monotonic()
+
+    def is_revoked(self, jti):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > current_app.config['TOKEN_REVOCATION_REFRESH']:
+            self.refresh()
+        return jti in self._revoked
+
+    def revoke(self, jti, expires_at):
+        RevokedToken(jti=jti, expires_at=expires_at).save()
+        with self._lock:
+            self._revoked[jti] = expires_at.timestamp()
+
+
+def init_app(app):
+    app.extensions['revocation_list'] = RevocationList()
+
+
+# Returns the user id in the token, or None if it is forged, expired or logged out
+def load_signed_token(token):
+    payload = decode_signed_token(token)
+    if payload is None or current_app.extensions['revocation_list'].is_revoked(payload.get('jti')):
+        return None
+    return payload.get('sub')
+
+
+def revoke_signed_token(token):
+    payload = decode_signed_token(token)
+    if payload is None:
+        return
+    expires_at = datetime.fromtimestamp(payload['exp'], timezone.utc)
+    current_app.extensions['revocation_list'].revoke(payload['jti'], expires_at)
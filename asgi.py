@@ -0,0 +1,18 @@
+# ASGI entry point, an alternative to running the Flask app under gunicorn sync workers
+#   uvicorn asgi:application --workers 4
+# GET /posts, GET /posts/<id> and GET /posts/<id>/comments are async views (app/async_routes.py)
+# Every other request falls through to the regular Flask app, run in a thread pool
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from app import create_app
+from app.async_routes import routes, lifespan
+
+app = create_app()
+
+application = Starlette(
+    routes=routes + [Mount('/', app=WSGIMiddleware(app))],
+    lifespan=lifespan,
+)
+application.state.flask_app = app
@@ -0,0 +1,108 @@
+# Load test the same read endpoints under gunicorn sync workers and under uvicorn (asgi.py)
+# with the same number of worker processes
+# Run from the project root: python -m benchmarks.asgi_vs_wsgi [workers] [concurrency] [seconds]
+# Uses a throwaway SQLite database unless DATABASE_URL is set
+
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "asgi_benchmark.db")
+
+from app import create_app, db
+from app.models import User, Post, Comment
+
+app = create_app()
+
+PORT = 8765
+URLS = ["/posts?limit=20", "/posts/1", "/posts/1/comments?limit=20"]
+SERVERS = {
+    "gunicorn sync": ["gunicorn", "--workers", "{workers}", "--bind", f"127.0.0.1:{PORT}", "wsgi:app"],
+    "uvicorn asgi": ["uvicorn", "--workers", "{workers}", "--port", str(PORT), "--log-level", "warning", "asgi:application"],
+}
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    user = User(first_name="Bench", last_name="Mark", email="bench@mark.com", username="benchmark", password="123")
+    user.save()
+    post_ids = Post.bulk_insert([{"title": f"Post {i}", "body": "Benchmark " * 20, "user_id": user.id} for i in range(1000)], enqueue=False)
+    Comment.bulk_insert([{"body": "Benchmark comment", "user_id": user.id, "post_id": post_ids[0]} for _ in range(50)], enqueue=False)
+    db.session.commit()
+
+
+def wait_for_server():
+    for _ in range(100):
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=1)
+            connection.request("GET", "/posts/1")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+def load(concurrency, seconds):
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=10)
+        i = 0
+        while time.perf_counter() < deadline:
+            url = URLS[i % len(URLS)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                connection.request("GET", url)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(e)
+                connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=10)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    seconds = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    with app.app_context():
+        seed()
+
+    print(f"{workers} workers, {concurrency} concurrent clients, {seconds}s per server")
+    print(f"{'server':<16}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, command in SERVERS.items():
+        command = [part.format(workers=workers) for part in command]
+        server = subprocess.Popen(command, env=os.environ.copy(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_server()
+            latencies, errors = load(concurrency, seconds)
+        finally:
+            server.terminate()
+            server.wait()
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"{name:<16}{len(latencies) / seconds:>10.0f}{quantiles[49] * 1000:>10.1f}{quantiles[98] * 1000:>10.1f}{len(errors):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Inserts per second through the API with and without UNIT_OF_WORK
+# Run from the project root: python -m benchmarks.inserts [number_of_requests]
+# Uses a throwaway SQLite database unless DATABASE_URL is set
+
+import base64
+import os
+import sys
+import tempfile
+import time
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "insert_benchmark.db")
+
+from app import create_app, db
+
+app = create_app()
+
+
+def get_headers(client):
+    client.post('/users', json={
+        "firstName": "Bench", "lastName": "Mark", "username": "benchmark", "email": "bench@mark.com", "password": "123"
+    })
+    credentials = base64.b64encode(b"benchmark:123").decode()
+    token = client.get('/token', headers={"Authorization": "Basic " + credentials}).json["token"]
+    return {"Authorization": "Bearer " + token}
+
+
+def run(client, headers, n_requests):
+    start = time.perf_counter()
+    post_id = None
+    for i in range(n_requests):
+        # alternate posts and comments so both write paths are measured
+        if i % 2 == 0:
+            post_id = client.post('/posts', json={"title": f"Post {i}", "body": "Benchmark"}, headers=headers).json["id"]
+        else:
+            client.post(f'/posts/{post_id}/comments', json={"body": "Benchmark"}, headers=headers)
+    return n_requests / (time.perf_counter() - start)
+
+
+def main():
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    client = app.test_client()
+    headers = get_headers(client)
+
+    results = {}
+    for unit_of_work in (False, True):
+        app.config["UNIT_OF_WORK"] = unit_of_work
+        results[unit_of_work] = run(client, headers, n_requests)
+        print(f"UNIT_OF_WORK={unit_of_work}: {results[unit_of_work]:.0f} inserts/sec")
+    print(f"speedup: {results[True] / results[False]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# Concurrent sign ups: threads register at the same moment, many of them with a username or an
+# email (in another case) that another thread is registering too
+#   check-then-insert   what create_user used to do: SELECT ... WHERE username = ? OR email = ?, INSERT,
+#                       then reload the row for to_dict(). A duplicate that slips past the SELECT is a 500
+#   insert              what it does now: INSERT and let the unique indexes turn duplicates into a 400
+# Both run the statements directly with a precomputed password hash, so the numbers are about the
+# database round trips and not the hashing. Then POST /users itself is run through the test client
+# Every run checks that the user table has no duplicate usernames or emails (ignoring case)
+# Run from the project root: python -m benchmarks.registration [--attempts 2000] [--threads 8]
+# Uses a throwaway SQLite database unless DATABASE_URL is set
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "registration_benchmark.db")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "none")
+# keep the job workers' polling out of the statement counts
+os.environ.setdefault("JOB_WORKER_THREADS", "0")
+# with SQLite the threads wait on each other's write locks, which would log every INSERT as slow
+os.environ.setdefault("SLOW_QUERY_THRESHOLD_MS", "inf")
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db
+from app.models import User
+
+app = create_app()
+
+PASSWORD_HASH = "scrypt:32768:8:1$benchmark$0"
+
+
+# Usernames and emails are drawn from a pool smaller than the number of attempts so a lot of them
+# collide, and emails get a random case so only the case-insensitive index catches some of them
+def make_attempts(n, collide, seed):
+    rng = random.Random(seed)
+    pool = max(1, int(n * (1 - collide)))
+    attempts = []
+    for _ in range(n):
+        email = f"person{rng.randrange(pool)}@example.com"
+        email = ''.join(c.upper() if rng.random() < 0.3 else c for c in email)
+        attempts.append({"first_name": "Bench", "last_name": "Mark", "username": f"person{rng.randrange(pool)}",
+                         "email": email, "password": PASSWORD_HASH})
+    return attempts
+
+
+def check_then_insert(row):
+    taken = db.session.execute(db.select(User.id).where((User.username == row["username"]) | (User.email == row["email"]))).first()
+    if taken:
+        return 400
+    try:
+        new_id = db.session.execute(db.insert(User).returning(User.id), row).scalar_one()
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return 500
+    # to_dict() after the commit reloaded the row
+    db.session.execute(db.select(User).where(User.id == new_id)).scalar_one()
+    return 201
+
+
+def insert(row):
+    try:
+        db.session.execute(db.insert(User).returning(User), row).scalar_one()
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return 400
+    return 201
+
+
+def post_user(client):
+    def register(row):
+        body = {"firstName": row["first_name"], "lastName": row["last_name"], "username": row["username"],
+                "email": row["email"], "password": "password"}
+        return client.post("/users", json=body).status_code
+    return register
+
+
+# Split the attempts over the threads, start them together and count the status codes
+def run(make_register, attempts, threads):
+    statuses = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(rows):
+        register = make_register()
+        results = []
+        with app.app_context():
+            barrier.wait()
+            for row in rows:
+                results.append(register(row))
+            db.session.remove()
+        with lock:
+            statuses.extend(results)
+
+    workers = [threading.Thread(target=worker, args=(attempts[i::threads],)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return statuses, time.perf_counter() - start
+
+
+def count_duplicates():
+    duplicates = 0
+    for column in (User.username, db.func.lower(User.email)):
+        groups = db.select(column).group_by(column).having(db.func.count() > 1).subquery()
+        duplicates += db.session.scalar(db.select(db.func.count()).select_from(groups))
+    return duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent registrations with colliding usernames and emails")
+    parser.add_argument("--attempts", type=int, default=2000, help="Registrations per strategy")
+    parser.add_argument("--route-attempts", type=int, default=100, help="Registrations through POST /users (they hash passwords)")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--collide", type=float, default=0.5, help="Share of attempts that reuse a username or email")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        engine = db.engine
+
+    statements = [0]
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(*args):
+        statements[0] += 1
+
+    strategies = [
+        ("check-then-insert", lambda: check_then_insert, args.attempts),
+        ("insert", lambda: insert, args.attempts),
+        ("POST /users", lambda: post_user(app.test_client()), args.route_attempts),
+    ]
+    print(f"{args.threads} threads, {args.collide:.0%} of attempts collide, {engine.url.get_backend_name()}")
+    print(f"{'strategy':<20}{'attempts':>9}{'reg/s':>9}{'201':>7}{'400':>7}{'other':>7}{'stmts/reg':>11}{'dupes':>7}")
+    failed = False
+    for name, make_register, n in strategies:
+        with app.app_context():
+            db.session.execute(db.delete(User))
+            db.session.commit()
+        attempts = make_attempts(n, args.collide, args.seed)
+        statements[0] = 0
+        statuses, elapsed = run(make_register, attempts, args.threads)
+        created = statuses.count(201)
+        with app.app_context():
+            duplicates = count_duplicates()
+            rows = db.session.scalar(db.select(db.func.count()).select_from(User))
+        other = len(statuses) - created - statuses.count(400)
+        print(f"{name:<20}{n:>9}{n / elapsed:>9.0f}{created:>7}{statuses.count(400):>7}{other:>7}"
+              f"{statements[0] / n:>11.2f}{duplicates:>7}")
+        # the old way is expected to 500 on races, what it must never do is store a duplicate
+        if duplicates or rows != created or (name != "check-then-insert" and other):
+            failed = True
+    if failed:
+        raise SystemExit("Duplicate users were stored or registrations failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# Throughput and p50/p95/p99 latency for every route in app/routes.py on a seeded database
+# Results are written to benchmarks/results/<timestamp>-<commit>.json and compared with the
+# previous results file so a regression between commits shows up as a big change in the table
+# Run from the project root: python -m benchmarks.routes [--server] [--seconds 2] [--concurrency 8]
+# Without --server requests go through Flask's test client in this process, with it they go over
+# HTTP to a local gunicorn. Uses a throwaway SQLite database unless DATABASE_URL is set
+# Rate limiting and the job worker threads are off unless RATE_LIMIT_BACKEND / JOB_WORKER_THREADS are set
+
+import argparse
+import base64
+import glob
+import http.client
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "routes_benchmark.db")
+# measure the routes themselves, not how fast the rate limiter turns clients away
+os.environ.setdefault("RATE_LIMIT_BACKEND", "none")
+# or job workers in the same processes draining the jobs the write routes queue
+os.environ.setdefault("JOB_WORKER_THREADS", "0")
+
+from app import create_app, db
+from fake_data.generate import generate, PASSWORD
+
+app = create_app()
+
+PORT = 8766
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+# Same interface for both ways of sending requests: request(method, url, headers, body) -> (status, body)
+# body is the parsed JSON, or the text for responses that aren't JSON
+class TestClientTransport:
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, url, headers=None, body=None):
+        response = self.client.open(url, method=method, headers=headers, json=body)
+        body = response.get_json(silent=True)
+        return response.status_code, response.get_data(as_text=True) if body is None else body
+
+
+class HTTPTransport:
+    def __init__(self):
+        self.connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=30)
+
+    def request(self, method, url, headers=None, body=None):
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            self.connection.request(method, url, body=data, headers=headers)
+            response = self.connection.getresponse()
+            raw = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=30)
+            raise
+        try:
+            return response.status, json.loads(raw)
+        except ValueError:
+            return response.status, raw.decode()
+
+
+def basic_headers(username):
+    credentials = base64.b64encode(f"{username}:{PASSWORD}".encode()).decode()
+    return {"Authorization": "Basic " + credentials}
+
+
+def get_token(transport, username):
+    status, body = transport.request("GET", "/token", basic_headers(username))
+    return {"Authorization": "Bearer " + body["token"]}
+
+
+# Each scenario is called (untimed) with the transport, a random generator, the client thread number
+# and the iteration number and returns the request to time: (method, url, headers, body)
+# Reads pick a hot post most of the time, like real traffic does
+class Scenarios:
+    def __init__(self, transport, summary):
+        self.summary = summary
+        self.run_id = datetime.now(timezone.utc).strftime("%H%M%S%f")
+        # user0 does the writes, client thread w logs user<w + 1> in and out so user0's token stays valid
+        self.headers = get_token(transport, "user0")
+
+    def pick_post(self, rng):
+        if rng.random() < 0.8:
+            return rng.choice(self.summary['hot_post_ids'])
+        return rng.choice(self.summary['post_ids'])
+
+    def new_post(self, transport):
+        status, body = transport.request("POST", "/posts", self.headers, {"title": "Benchmark", "body": "Benchmark"})
+        return body["id"]
+
+    def new_comment(self, transport, post_id):
+        status, body = transport.request("POST", f"/posts/{post_id}/comments", self.headers, {"body": "Benchmark"})
+        return body["id"]
+
+    def all(self):
+        return {
+            "index": lambda t, rng, w, i: ("GET", "/", None, None),
+            "create_user": lambda t, rng, w, i: ("POST", "/users", None, {
+                "firstName": "Bench", "lastName": "Mark", "username": f"bench{self.run_id}_{i}",
+                "email": f"bench{self.run_id}_{i}@example.com", "password": PASSWORD
+            }),
+            "get_token": lambda t, rng, w, i: ("GET", "/token", basic_headers(f"user{w + 1}"), None),
+            "revoke_token": lambda t, rng, w, i: ("DELETE", "/token", get_token(t, f"user{w + 1}"), None),
+            "worker_metrics": lambda t, rng, w, i: ("GET", "/metrics/worker", None, None),
+            "metrics": lambda t, rng, w, i: ("GET", "/metrics", None, None),
+            "test": lambda t, rng, w, i: ("GET", "/test", None, None),
+            "get_posts": lambda t, rng, w, i: ("GET", "/posts?limit=20", None, None),
+            "get_posts_fields": lambda t, rng, w, i: ("GET", "/posts?limit=100&fields=id,title,commentCount", None, None),
+            "get_posts_search": lambda t, rng, w, i: ("GET", "/posts?limit=20&search=" + rng.choice(["flask", "cache", "postgres"]), None, None),
+            "get_post": lambda t, rng, w, i: ("GET", f"/posts/{self.pick_post(rng)}", None, None),
+            "create_posts": lambda t, rng, w, i: ("POST", "/posts", self.headers, {"title": "Benchmark", "body": "Benchmark"}),
+            "create_posts_bulk": lambda t, rng, w, i: ("POST", "/posts/bulk", self.headers, [{"title": "Benchmark", "body": "Benchmark"}] * 50),
+            "edit_post": lambda t, rng, w, i: ("PUT", f"/posts/{self.new_post(t)}", self.headers, {"title": "Edited"}),
+            "delete_post": lambda t, rng, w, i: ("DELETE", f"/posts/{self.new_post(t)}", self.headers, None),
+            "get_comments": lambda t, rng, w, i: ("GET", f"/posts/{self.pick_post(rng)}/comments?limit=20", None, None),
+            "create_comment": lambda t, rng, w, i: ("POST", f"/posts/{self.pick_post(rng)}/comments", self.headers, {"body": "Benchmark"}),
+            "create_comments_bulk": lambda t, rng, w, i: ("POST", f"/posts/{self.pick_post(rng)}/comments/bulk", self.headers, [{"body": "Benchmark"}] * 50),
+            "delete_comment": lambda t, rng, w, i: self.delete_comment(t, rng),
+        }
+
+    def delete_comment(self, transport, rng):
+        post_id = self.pick_post(rng)
+        return ("DELETE", f"/posts/{post_id}/comments/{self.new_comment(transport, post_id)}", self.headers, None)
+
+
+# Warn about routes added to app/routes.py without a scenario here
+def check_coverage(scenarios):
+    # endpoints are named <blueprint>.<view>, the scenarios are named after the view
+    endpoints = {rule.endpoint.rsplit(".", 1)[-1] for rule in app.url_map.iter_rules() if rule.endpoint != "static"}
+    # get_posts_fields and get_posts_search are extra scenarios for the get_posts endpoint
+    for endpoint in sorted(endpoints - set(scenarios)):
+        print(f"warning: no benchmark scenario for {endpoint}")
+
+
+# Run one scenario for the given number of seconds on concurrency threads, each with its own transport
+def run_scenario(make_transport, scenario, seconds, concurrency, seed):
+    latencies = []
+    errors = []
+    counter = itertools.count()
+    deadline = time.perf_counter() + seconds
+
+    def worker(worker_id):
+        transport = make_transport()
+        rng = random.Random(seed + worker_id)
+        while time.perf_counter() < deadline:
+            method, url, headers, body = scenario(transport, rng, worker_id, next(counter))
+            start = time.perf_counter()
+            try:
+                status, _ = transport.request(method, url, headers, body)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(status)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = {"requests": len(latencies), "errors": len(errors), "rps": round(len(latencies) / elapsed, 1)}
+    if len(latencies) >= 2:
+        quantiles = statistics.quantiles(latencies, n=100)
+        result.update(p50_ms=round(quantiles[49] * 1000, 2), p95_ms=round(quantiles[94] * 1000, 2), p99_ms=round(quantiles[98] * 1000, 2))
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def latest_results(mode):
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")), reverse=True):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous.get("mode") == mode:
+            return path, previous
+    return None, None
+
+
+def print_table(results, previous):
+    print(f"{'route':<22}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'vs prev p95':>13}")
+    for name, result in results.items():
+        change = ""
+        old = (previous or {}).get("routes", {}).get(name)
+        if old and old.get("p95_ms") and result.get("p95_ms"):
+            change = f"{(result['p95_ms'] / old['p95_ms'] - 1) * 100:+.0f}%"
+        print(f"{name:<22}{result['rps']:>9.0f}{result.get('p50_ms', 0):>9.1f}{result.get('p95_ms', 0):>9.1f}"
+              f"{result.get('p99_ms', 0):>9.1f}{result['errors']:>8}{change:>13}")
+
+
+def wait_for_server():
+    for _ in range(100):
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=1)
+            connection.request("GET", "/test")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every route on a seeded database")
+    parser.add_argument("--server", action="store_true", help="Send requests over HTTP to a local gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers with --server")
+    parser.add_argument("--concurrency", type=int, default=1, help="Client threads per route")
+    parser.add_argument("--seconds", type=float, default=2, help="Time spent on each route")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", help="Comma separated routes to run")
+    parser.add_argument("--no-save", action="store_true", help="Print the results without writing a JSON file")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        summary = generate(args.users, args.posts, args.comments, seed=args.seed)
+        database = db.engine.url.get_backend_name()
+
+    server = None
+    if args.server:
+        mode = f"gunicorn-{args.workers}w-{args.concurrency}c"
+        command = ["gunicorn", "--workers", str(args.workers), "--bind", f"127.0.0.1:{PORT}", "wsgi:app"]
+        server = subprocess.Popen(command, env=os.environ.copy(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        make_transport = HTTPTransport
+    else:
+        mode = f"test-client-{args.concurrency}c"
+        make_transport = TestClientTransport
+
+    try:
+        if server:
+            wait_for_server()
+        scenarios = Scenarios(make_transport(), summary).all()
+        check_coverage(scenarios)
+        if args.only:
+            scenarios = {name: scenarios[name] for name in args.only.split(",")}
+        results = {}
+        for name, scenario in scenarios.items():
+            results[name] = run_scenario(make_transport, scenario, args.seconds, args.concurrency, args.seed)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    previous_path, previous = latest_results(mode)
+    print(f"{mode}, {args.seconds}s per route" + (f", compared with {os.path.basename(previous_path)}" if previous_path else ""))
+    print_table(results, previous)
+
+    if not args.no_save:
+        commit = git_commit()
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{commit}.json")
+        output = {
+            "commit": commit,
+            "mode": mode,
+            "database": database,
+            "dataset": {"users": args.users, "posts": args.posts, "comments": args.comments, "seed": args.seed},
+            "seconds": args.seconds,
+            "routes": results,
+        }
+        with open(path, "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
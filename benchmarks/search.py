@@ -0,0 +1,71 @@
+# Compare the old ILIKE '%term%' scan with the full-text index on a large generated table
+# Run from the project root: python -m benchmarks.search [number_of_posts]
+# Uses a throwaway SQLite database unless DATABASE_URL is set
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "search_benchmark.db")
+
+from app import create_app, db
+from app.models import User, Post
+from app.search import search_posts, create_sqlite_fts
+
+app = create_app()
+
+
+WORDS = ["flask", "python", "database", "index", "query", "token", "react", "deploy", "cache", "router",
+         "model", "migration", "search", "comment", "author", "session", "request", "server", "client", "json"]
+SEARCH_TERMS = ["flask", "database index", "zebra", "json request"]
+REPEATS = 5
+
+
+def random_text(n_words):
+    # pad with filler so only some posts contain the vocabulary words
+    return ' '.join(random.choice(WORDS) if random.random() < 0.1 else f"w{random.randint(0, 50000)}" for _ in range(n_words))
+
+
+def seed(n_posts):
+    db.drop_all()
+    db.create_all()
+    user = User(first_name="Bench", last_name="Mark", email="bench@mark.com", username="benchmark", password="123")
+    user.save()
+    rows = [{"title": random_text(6), "body": random_text(60), "user_id": user.id} for _ in range(n_posts)]
+    for i in range(0, n_posts, 10000):
+        db.session.execute(db.insert(Post), rows[i:i + 10000])
+    db.session.commit()
+    if db.engine.dialect.name == 'sqlite':
+        create_sqlite_fts()
+
+
+def time_query(select_stmt):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        count = len(db.session.execute(select_stmt.limit(20)).scalars().all())
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, count
+
+
+def main():
+    n_posts = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(0)
+    with app.app_context():
+        print(f"Seeding {n_posts} posts into {db.engine.url}")
+        seed(n_posts)
+        print(f"{'term':<16}{'ilike ms':>12}{'fts ms':>12}{'speedup':>10}")
+        for term in SEARCH_TERMS:
+            pattern = '%' + term + '%'
+            ilike_stmt = db.select(Post.id).where(Post.title.ilike(pattern) | Post.body.ilike(pattern)).order_by(Post.date_created.desc())
+            fts_stmt, _ = search_posts(db.select(Post.id), term)
+            ilike_ms, _ = time_query(ilike_stmt)
+            fts_ms, _ = time_query(fts_stmt)
+            print(f"{term:<16}{ilike_ms:>12.2f}{fts_ms:>12.2f}{ilike_ms / fts_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
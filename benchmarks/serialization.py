@@ -0,0 +1,56 @@
+# Time to serialize the GET /posts/<id> response for posts with 0, 10 and 1000 comments, orjson vs the stdlib provider
+# Only the first page of comments is in the response, so 1000 comments should cost about the same as 10
+# Run from the project root: python -m benchmarks.serialization
+# Uses a throwaway SQLite database unless DATABASE_URL is set
+
+import os
+import tempfile
+import timeit
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "serialization_benchmark.db")
+
+from app import create_app, db
+from app.models import User, Post, Comment
+from app.json_provider import ORJSONProvider, StdlibJSONProvider, orjson
+
+app = create_app()
+
+COMMENT_COUNTS = [0, 10, 1000]
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    user = User(first_name="Bench", last_name="Mark", email="bench@mark.com", username="benchmark", password="123")
+    user.save()
+    post_ids = Post.bulk_insert([{"title": f"{n} comments", "body": "Benchmark " * 20, "user_id": user.id} for n in COMMENT_COUNTS], enqueue=False)
+    for post_id, n_comments in zip(post_ids, COMMENT_COUNTS):
+        if n_comments:
+            Comment.bulk_insert([{"body": "Benchmark comment", "user_id": user.id, "post_id": post_id} for _ in range(n_comments)], enqueue=False)
+    db.session.commit()
+    return post_ids
+
+
+def main():
+    providers = {"stdlib": StdlibJSONProvider(app)}
+    if orjson:
+        providers["orjson"] = ORJSONProvider(app)
+    else:
+        print("orjson is not installed, only timing the stdlib provider")
+
+    with app.app_context():
+        post_ids = seed()
+        print(f"{'comments':>9}" + ''.join(f"{name + ' us':>14}" for name in providers))
+        for post_id, n_comments in zip(post_ids, COMMENT_COUNTS):
+            post_dict = app.test_client().get(f"/posts/{post_id}").json
+            number = max(10, 10000 // (n_comments + 1))
+            timings = []
+            for provider in providers.values():
+                seconds = min(timeit.repeat(lambda: provider.dumps(post_dict), number=number, repeat=5))
+                timings.append(seconds / number * 1000000)
+            print(f"{n_comments:>9}" + ''.join(f"{timing:>14.1f}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
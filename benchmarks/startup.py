@@ -0,0 +1,102 @@
+# Cold start time and per-worker memory
+#   import time   time to import the WSGI app in a fresh interpreter (median of 5 runs)
+#   boot time     time from starting gunicorn until every worker has answered a request
+#   RSS           resident memory of each gunicorn worker after it has served some requests
+# Run from the project root: python -m benchmarks.startup [module:app] [workers]
+# Uses a throwaway SQLite database unless DATABASE_URL is set
+
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "startup_benchmark.db")
+
+PORT = 8767
+IMPORT_SCRIPT = """
+import importlib, sys, time
+start = time.perf_counter()
+module_name, attribute = sys.argv[1].split(':')
+getattr(importlib.import_module(module_name), attribute)
+elapsed = time.perf_counter() - start
+print(elapsed, len(sys.modules), int('flask_migrate' in sys.modules), int('alembic' in sys.modules))
+"""
+
+
+def measure_import(target, runs=5):
+    times = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT, target], capture_output=True, text=True, check=True).stdout
+        elapsed, modules, migrate_loaded, alembic_loaded = output.split()
+        times.append(float(elapsed))
+    return statistics.median(times), int(modules), migrate_loaded == "1" or alembic_loaded == "1"
+
+
+def get_children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def get_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def get(url):
+    connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=5)
+    connection.request("GET", url)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+def measure_workers(target, workers):
+    start = time.perf_counter()
+    command = [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind", f"127.0.0.1:{PORT}", target]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # new connections are spread over the workers, keep asking until every worker has booted
+        while True:
+            try:
+                get("/test")
+                if len(get_children(server.pid)) == workers:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.01)
+        boot_time = time.perf_counter() - start
+        for _ in range(200):
+            get("/posts?limit=20")
+        rss = [get_rss_mb(pid) for pid in get_children(server.pid)]
+    finally:
+        server.terminate()
+        server.wait()
+    return boot_time, rss
+
+
+def main():
+    target = sys.argv[1] if len(sys.argv) > 1 else "wsgi:app"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    # make sure the tables exist so the requests below are real ones
+    subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.replace("getattr(", "app = getattr(") +
+                    "\nfrom app import db\nwith app.app_context(): db.create_all()", target], check=True, capture_output=True)
+
+    import_time, modules, migrate_loaded = measure_import(target)
+    boot_time, rss = measure_workers(target, workers)
+    print(f"{target}")
+    print(f"import time      {import_time * 1000:.0f} ms ({modules} modules, Flask-Migrate/alembic {'loaded' if migrate_loaded else 'not loaded'})")
+    print(f"boot time        {boot_time * 1000:.0f} ms for {workers} gunicorn workers")
+    print(f"RSS per worker   {statistics.mean(rss):.1f} MB ({', '.join(f'{value:.1f}' for value in rss)})")
+
+
+if __name__ == "__main__":
+    main()
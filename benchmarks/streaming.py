@@ -0,0 +1,58 @@
+# Peak Python memory of GET /posts as one big page vs ?stream=true
+# Run from the project root: python -m benchmarks.streaming [number_of_posts]
+# Uses a throwaway SQLite database unless DATABASE_URL is set
+
+import os
+import sys
+import tempfile
+import tracemalloc
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "streaming_benchmark.db")
+
+from app import create_app, db
+from app.models import User, Post
+
+app = create_app()
+
+
+def seed(n_posts):
+    db.drop_all()
+    db.create_all()
+    user = User(first_name="Bench", last_name="Mark", email="bench@mark.com", username="benchmark", password="123")
+    user.save()
+    rows = [{"title": f"Post {i}", "body": "Benchmark " * 20, "user_id": user.id} for i in range(n_posts)]
+    for i in range(0, n_posts, 10000):
+        db.session.execute(db.insert(Post), rows[i:i + 10000])
+    db.session.commit()
+
+
+# Returns (peak bytes allocated while handling the request, size of the response body)
+def measure(client, url):
+    tracemalloc.start()
+    response = client.get(url, buffered=False)
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, size
+
+
+def main():
+    n_posts = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    # let the buffered request return everything in one page
+    app.config["PAGINATION_MAX_LIMIT"] = n_posts
+    with app.app_context():
+        seed(n_posts)
+    client = app.test_client()
+
+    print(f"{n_posts} posts")
+    for name, url in (("buffered", f"/posts?limit={n_posts}"), ("streamed", "/posts?stream=true")):
+        peak, size = measure(client, url)
+        print(f"{name:<10} peak {peak / 1024 / 1024:8.1f} MiB   response {size / 1024 / 1024:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,5 +6,117 @@ import os
 # __file__ this file's name
 basedir = os.path.abspath(os.path.dirname(__file__)) 
 
+# Connection pool settings, from environment variables so they can be sized per deployment
+# pool_size / max_overflow / pool_timeout only apply to the default QueuePool, so they are only
+# passed on when set (an in-memory SQLite database uses a different pool)
+def get_engine_options(database_uri):
+    options = {
+        # check connections are alive before handing them out, and replace ones older than this (seconds)
+        "pool_pre_ping" : os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+        "pool_recycle" : int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    }
+    if os.environ.get("DB_POOL_SIZE"):
+        options["pool_size"] = int(os.environ["DB_POOL_SIZE"])
+    if os.environ.get("DB_MAX_OVERFLOW"):
+        options["max_overflow"] = int(os.environ["DB_MAX_OVERFLOW"])
+    if os.environ.get("DB_POOL_TIMEOUT"):
+        options["pool_timeout"] = int(os.environ["DB_POOL_TIMEOUT"])
+    # Postgres cancels any statement running longer than this many milliseconds
+    if os.environ.get("DB_STATEMENT_TIMEOUT") and database_uri.startswith("postgres"):
+        options["connect_args"] = {"options" : f"-c statement_timeout={int(os.environ['DB_STATEMENT_TIMEOUT'])}"}
+    return options
+
+
 class Config:
-    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or "sqlite:///" + os.path.join(basedir, "app.db")
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or "sqlite:///" + os.path.join(basedir, "app.db")
+    SQLALCHEMY_ENGINE_OPTIONS = get_engine_options(SQLALCHEMY_DATABASE_URI)
+
+    # Optional read replicas, comma separated, used by the GET routes
+    SQLALCHEMY_BINDS = {
+        f"replica_{i}" : url.strip()
+        for i, url in enumerate(os.environ.get("DATABASE_REPLICA_URLS", "").split(","))
+        if url.strip()
+    }
+    # After a write, that client reads from the primary for this many seconds
+    REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+    # How many of those recent writers (by token, for clients without cookies) each worker remembers
+    REPLICA_STICKY_CACHE_SIZE = int(os.environ.get("REPLICA_STICKY_CACHE_SIZE", 10000))
+
+    # Page sizes for the cursor-paginated listings (GET /posts, GET /posts/<id>/comments)
+    PAGINATION_DEFAULT_LIMIT = int(os.environ.get("PAGINATION_DEFAULT_LIMIT", 20))
+    PAGINATION_MAX_LIMIT = int(os.environ.get("PAGINATION_MAX_LIMIT", 100))
+
+    # In-process cache of verified tokens (per worker), set the size to 0 to turn it off
+    # The TTL is how long a worker can keep accepting a token after it was logged out through another worker
+    TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 1024))
+    TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", 60))
+
+    # Used to sign tokens when TOKEN_MODE is "signed", must be the same on every worker
+    SECRET_KEY = os.environ.get("SECRET_KEY")
+
+    # "database" stores a random token per login session in user_token and looks it up on every request
+    # "signed" hands out self-contained HMAC-signed tokens that are verified without the database
+    TOKEN_MODE = os.environ.get("TOKEN_MODE", "database")
+    TOKEN_LIFETIME = int(os.environ.get("TOKEN_LIFETIME", 3600))
+    # How often (seconds) each worker reloads the list of logged out signed tokens
+    TOKEN_REVOCATION_REFRESH = int(os.environ.get("TOKEN_REVOCATION_REFRESH", 5))
+    # Rows deleted per statement by flask sweep-tokens
+    TOKEN_SWEEP_BATCH_SIZE = int(os.environ.get("TOKEN_SWEEP_BATCH_SIZE", 1000))
+
+    # Processes per worker used for password hashing (0 hashes on the request thread)
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+    # Hashes allowed to be running or waiting at once before /token and /users answer 503
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get("PASSWORD_HASH_QUEUE_LIMIT", 16))
+
+    # Models only flush their changes and each request commits once at the end
+    UNIT_OF_WORK = os.environ.get("UNIT_OF_WORK", "false").lower() in ("1", "true", "yes")
+
+    # Most items accepted by POST /posts/bulk and POST /posts/<id>/comments/bulk
+    BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", 500))
+
+    # Response cache for GET /posts and GET /posts/<id>: "none", "memory", "redis" or "redis-stub"
+    RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "none")
+    RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 30))
+    RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1024))
+    REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+    # Rate limiting for the expensive endpoints: "none", "memory", "redis" or "redis-stub"
+    # "memory" keeps the buckets in each worker, so N workers let through up to N times the budget
+    RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+    # "<requests>/<second|minute|hour|day>" per client (the token's user, or else the IP address)
+    # Each client's bucket holds a whole period's worth, so short bursts are fine
+    RATE_LIMITS = {
+        "get_token" : os.environ.get("RATE_LIMIT_TOKEN", "10/minute"),
+        "create_user" : os.environ.get("RATE_LIMIT_CREATE_USER", "5/minute"),
+        "search" : os.environ.get("RATE_LIMIT_SEARCH", "60/minute"),
+        "bulk" : os.environ.get("RATE_LIMIT_BULK", "30/minute"),
+    }
+    # How many proxies (nginx, a load balancer) sit in front of the app and set X-Forwarded-For
+    # Clients without a token are limited by IP, so behind a proxy this has to be set or every
+    # one of them shares the proxy's bucket. Leave it at 0 when clients connect directly,
+    # otherwise they can pick their own IP with the header
+    PROXY_FIX_X_FOR = int(os.environ.get("PROXY_FIX_X_FOR", 0))
+    # Clients tracked per worker by the "memory" backend
+    RATE_LIMIT_CACHE_SIZE = int(os.environ.get("RATE_LIMIT_CACHE_SIZE", 10000))
+
+    # Rows fetched per round trip when GET /posts?stream=true streams the whole listing
+    STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 500))
+
+    # Database URL for the async routes served by asgi.py
+    # Defaults to DATABASE_URL with the asyncpg / aiosqlite driver swapped in
+    ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL")
+
+    # Log any SQL statement that takes longer than this (milliseconds)
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 200))
+    # Let clients ask for a cProfile dump of their request with an X-Profile header (never in production)
+    PROFILE_HEADER_ENABLED = os.environ.get("PROFILE_HEADER_ENABLED", "false").lower() in ("1", "true", "yes")
+    PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(basedir, "profiles")
+
+    # Background jobs for the side effects of writes (see app/jobs.py)
+    # Threads per web worker that run jobs, 0 to leave them all to flask run-jobs
+    JOB_WORKER_THREADS = int(os.environ.get("JOB_WORKER_THREADS", 1))
+    # Seconds an idle worker waits before looking for new jobs
+    JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+    JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+    # How long a job can run before another worker may take it over (after a crash)
+    JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 60))
@@ -0,0 +1,143 @@
+# Seed the database with synthetic users, posts and comments
+# Real blogs are skewed: a few authors write most of the posts and a few hot posts get most of
+# the comments, so both are drawn from a Zipf-like distribution instead of uniformly
+# Run from the project root: python -m fake_data.generate --users 10000 --posts 1000000 --comments 5000000
+# Every generated user can log in with their username (user<n>) and the password "password"
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.models import User, Post, Comment, bulk_insert
+
+PASSWORD = "password"
+WORDS = (
+    "flask python api database query index cache token post comment user request response json "
+    "server worker thread async pool latency throughput deploy docker postgres sqlite redis route "
+    "template session migration schema test benchmark profile search page cursor stream"
+).split()
+
+
+# Cumulative weights for n items where the item of rank r has weight 1 / r ** skew
+# The ranks are shuffled so the popular items are spread over the id range
+def zipf_weights(n, skew, rng):
+    weights = [1 / rank ** skew for rank in range(1, n + 1)]
+    rng.shuffle(weights)
+    return list(accumulate(weights))
+
+
+def sentence(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize()
+
+
+def random_date(rng, start, end):
+    return start + timedelta(seconds=rng.uniform(0, (end - start).total_seconds()))
+
+
+# Seeded rows don't queue background jobs, millions of them would only be drained and deleted
+def insert_batches(model, rows, batch_size):
+    ids = []
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            ids.extend(bulk_insert(model, batch, enqueue=False))
+            db.session.commit()
+            batch = []
+    ids.extend(bulk_insert(model, batch, enqueue=False))
+    db.session.commit()
+    return ids
+
+
+# Returns a summary with the new ids, hot_post_ids are the posts with the most comments
+def generate(n_users, n_posts, n_comments, skew=1.1, seed=0, batch_size=5000, days=365):
+    rng = random.Random(seed)
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=days)
+    # Hashing is slow on purpose, every user gets the same hash
+    password_hash = generate_password_hash(PASSWORD)
+
+    user_rows = ({
+        'first_name' : f"First{i}",
+        'last_name' : f"Last{i}",
+        'username' : f"user{i}",
+        'email' : f"user{i}@example.com",
+        'password' : password_hash,
+        'date_created' : random_date(rng, start, end)
+    } for i in range(n_users))
+    user_ids = insert_batches(User, user_rows, batch_size)
+
+    # Decide how many comments each post gets up front so comment_count can be written with the post
+    post_weights = zipf_weights(n_posts, skew, rng)
+    comment_counts = [0] * n_posts
+    for offset in range(0, n_comments, batch_size):
+        for index in rng.choices(range(n_posts), cum_weights=post_weights, k=min(batch_size, n_comments - offset)):
+            comment_counts[index] += 1
+
+    author_weights = zipf_weights(n_users, skew, rng)
+    post_dates = []
+
+    def make_post_rows():
+        for index in range(n_posts):
+            author_id = user_ids[rng.choices(range(n_users), cum_weights=author_weights)[0]]
+            date_created = random_date(rng, start, end)
+            post_dates.append(date_created)
+            yield {
+                'title' : sentence(rng, rng.randint(3, 8)),
+                'body' : sentence(rng, rng.randint(20, 120)),
+                'user_id' : author_id,
+                'date_created' : date_created,
+                'last_modified' : date_created,
+                'comment_count' : comment_counts[index]
+            }
+    post_ids = insert_batches(Post, make_post_rows(), batch_size)
+
+    # Comments go straight through bulk_insert since comment_count is already set
+    def make_comment_rows():
+        for index, count in enumerate(comment_counts):
+            for _ in range(count):
+                yield {
+                    'body' : sentence(rng, rng.randint(5, 40)),
+                    'user_id' : user_ids[rng.choices(range(n_users), cum_weights=author_weights)[0]],
+                    'post_id' : post_ids[index],
+                    'date_created' : random_date(rng, post_dates[index], end)
+                }
+    comment_ids = insert_batches(Comment, make_comment_rows(), batch_size)
+
+    by_comments = sorted(range(n_posts), key=lambda index: comment_counts[index], reverse=True)
+    return {
+        'user_ids' : user_ids,
+        'post_ids' : post_ids,
+        'comment_ids' : comment_ids,
+        'hot_post_ids' : [post_ids[index] for index in by_comments[:max(1, n_posts // 100)]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the database with skewed synthetic data")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=100000)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for authors and hot posts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--reset", action="store_true", help="Drop and recreate every table first")
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        if args.reset:
+            db.drop_all()
+            db.create_all()
+        start = time.perf_counter()
+        summary = generate(args.users, args.posts, args.comments, args.skew, args.seed, args.batch_size)
+        elapsed = time.perf_counter() - start
+    rows = len(summary['user_ids']) + len(summary['post_ids']) + len(summary['comment_ids'])
+    print(f"Inserted {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
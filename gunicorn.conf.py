@@ -0,0 +1,21 @@
+# gunicorn picks this file up automatically from the directory it is started in
+# It keeps the Prometheus multiprocess directory (PROMETHEUS_MULTIPROC_DIR) in order, see app/prometheus.py
+
+import glob
+import os
+
+
+# Clear out metric files from the last run
+def on_starting(server):
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+            os.remove(path)
+
+
+# Stop counting a dead worker's in-flight requests
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -45,6 +45,19 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+# The full-text search objects come from migration 5d2e8c41a7b3, not the models (see app/search.py),
+# so autogenerate must not see them as extra and try to drop them
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and name.startswith('post_fts'):
+        # post_fts and the post_fts_data / _idx / _docsize / _config tables FTS5 makes for it
+        return False
+    if type_ == 'column' and name == 'search_vector' and object.table.name == 'post':
+        return False
+    if type_ == 'index' and name == 'ix_post_search_vector':
+        return False
+    return True
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -65,7 +78,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +107,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
@@ -0,0 +1,58 @@
+"""add post full text search
+
+Revision ID: 5d2e8c41a7b3
+Revises: c61980309615
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8c41a7b3'
+down_revision = 'c61980309615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        # Generated column so the vector is always in sync with title/body, title weighted higher
+        op.add_column('post', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(body, '')), 'B')",
+            persisted=True
+        )))
+        op.create_index('ix_post_search_vector', 'post', ['search_vector'], unique=False, postgresql_using='gin')
+
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE post_fts USING fts5(title, body, content='post', content_rowid='id')")
+        op.execute("""CREATE TRIGGER post_fts_ai AFTER INSERT ON post BEGIN
+            INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+        END""")
+        op.execute("""CREATE TRIGGER post_fts_ad AFTER DELETE ON post BEGIN
+            INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        END""")
+        op.execute("""CREATE TRIGGER post_fts_au AFTER UPDATE OF title, body ON post BEGIN
+            INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+            INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+        END""")
+        op.execute("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.drop_index('ix_post_search_vector', table_name='post', postgresql_using='gin')
+        op.drop_column('post', 'search_vector')
+
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS post_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS post_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS post_fts_ai")
+        op.execute("DROP TABLE IF EXISTS post_fts")
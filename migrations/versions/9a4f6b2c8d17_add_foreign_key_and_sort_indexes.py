@@ -0,0 +1,36 @@
+"""add foreign key and sort indexes
+
+Revision ID: 9a4f6b2c8d17
+Revises: 5d2e8c41a7b3
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4f6b2c8d17'
+down_revision = '5d2e8c41a7b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index('ix_post_date_created_id', ['date_created', 'id'], unique=False)
+        batch_op.create_index('ix_post_user_id_date_created', ['user_id', 'date_created'], unique=False)
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_post_id_date_created_id', ['post_id', 'date_created', 'id'], unique=False)
+        batch_op.create_index('ix_comment_user_id', ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_user_id')
+        batch_op.drop_index('ix_comment_post_id_date_created_id')
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_user_id_date_created')
+        batch_op.drop_index('ix_post_date_created_id')
@@ -0,0 +1,33 @@
+"""add case-insensitive unique index on user email
+
+Revision ID: c5f1d8a3e962
+Revises: a6d8e2f4b731
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f1d8a3e962'
+down_revision = 'a6d8e2f4b731'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the index can't be built while two users share an email in different cases, those have to be sorted out by hand
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT lower(email) FROM "user" GROUP BY lower(email) HAVING count(*) > 1'
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(f"Users share these emails (ignoring case), merge or change them first: {', '.join(duplicates)}")
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_email_lower', [sa.text('lower(email)')], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_email_lower')
@@ -0,0 +1,30 @@
+"""add post last_modified
+
+Revision ID: d41c7a9e3b58
+Revises: b7c3e1f0a925
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7a9e3b58'
+down_revision = 'b7c3e1f0a925'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('post', sa.Column('last_modified', sa.DateTime(timezone=True), nullable=True))
+    # Existing posts haven't changed since they were created
+    op.execute("UPDATE post SET last_modified = date_created")
+    # SQLite can only change nullability by rebuilding the table, which would drop the search triggers
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column('post', 'last_modified', existing_type=sa.DateTime(timezone=True), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('last_modified')
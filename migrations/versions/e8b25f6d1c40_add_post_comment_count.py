@@ -0,0 +1,26 @@
+"""add post comment_count
+
+Revision ID: e8b25f6d1c40
+Revises: d41c7a9e3b58
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b25f6d1c40'
+down_revision = 'd41c7a9e3b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('post', sa.Column('comment_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute("UPDATE post SET comment_count = (SELECT count(*) FROM comment WHERE comment.post_id = post.id)")
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('comment_count')
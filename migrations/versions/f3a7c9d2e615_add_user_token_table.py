@@ -0,0 +1,59 @@
+"""add user_token table for login sessions
+
+Revision ID: f3a7c9d2e615
+Revises: e8b25f6d1c40
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a7c9d2e615'
+down_revision = 'e8b25f6d1c40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_token',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('token', sa.String(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('date_created', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('user_token', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_token_token'), ['token'], unique=True)
+        batch_op.create_index(batch_op.f('ix_user_token_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_user_token_user_id'), ['user_id'], unique=False)
+
+    # Keep everyone who is logged in right now logged in
+    op.execute(
+        'INSERT INTO user_token (user_id, token, expires_at, date_created) '
+        'SELECT id, token, token_expiration, CURRENT_TIMESTAMP FROM "user" '
+        'WHERE token IS NOT NULL AND token_expiration > CURRENT_TIMESTAMP'
+    )
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_token')
+        batch_op.drop_column('token_expiration')
+        batch_op.drop_column('token')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('token', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('token_expiration', sa.DateTime(timezone=True), nullable=True))
+        batch_op.create_index('ix_user_token', ['token'], unique=True)
+
+    # Sessions can't be carried back, everyone logs in again
+    with op.batch_alter_table('user_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_token_user_id'))
+        batch_op.drop_index(batch_op.f('ix_user_token_expires_at'))
+        batch_op.drop_index(batch_op.f('ix_user_token_token'))
+
+    op.drop_table('user_token')
@@ -0,0 +1,181 @@
+# The job queue (app/jobs.py): writes to posts and comments queue jobs in the same transaction,
+# run_pending_jobs() runs them, failures are retried up to JOB_MAX_ATTEMPTS and a job whose
+# worker died is picked up again once its lease runs out
+# The worker threads are off (JOB_WORKER_THREADS = 0), the tests run the jobs themselves
+# Run from the project root: pip install -r requirements-dev.txt, then python -m pytest
+
+import base64
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+import pytest
+from app import create_app, db, jobs
+from app.models import Job, Post, User
+from config import Config
+
+
+def make_config(database_path):
+    return type("JobsConfig", (Config,), {
+        "SQLALCHEMY_DATABASE_URI" : f"sqlite:///{database_path}",
+        "SQLALCHEMY_BINDS" : {},
+        "RESPONSE_CACHE_BACKEND" : "none",
+        "RATE_LIMIT_BACKEND" : "none",
+        "JOB_WORKER_THREADS" : 0,
+        "JOB_MAX_ATTEMPTS" : 3,
+        "PASSWORD_HASH_WORKERS" : 0,
+    })
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # handlers are registered module-wide, give every test its own
+    monkeypatch.setattr(jobs, "handlers", defaultdict(list))
+    app = create_app(make_config(tmp_path / "jobs.db"))
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(client):
+    response = client.post("/users", json={"firstName" : "Job", "lastName" : "Tester", "username" : "jobs",
+                                           "email" : "jobs@example.com", "password" : "password"})
+    assert response.status_code == 201, response.json
+    basic = base64.b64encode(b"jobs:password").decode()
+    token = client.get("/token", headers={"Authorization" : f"Basic {basic}"}).json["token"]
+    # the sign up doesn't queue anything, start every test from an empty queue
+    assert queued() == []
+    return {"Authorization" : f"Bearer {token}"}
+
+
+# (kind, payload) of every job in the table, oldest first
+def queued():
+    return [(job.kind, job.payload) for job in db.session.scalars(db.select(Job).order_by(Job.id))]
+
+
+def get_job():
+    db.session.expire_all()
+    return db.session.scalars(db.select(Job)).one()
+
+
+# Make a job due now, as if its retry delay or lease had run out
+def make_due(job):
+    job.run_after = datetime.now(timezone.utc) - timedelta(seconds=1)
+    db.session.commit()
+
+
+def test_writes_queue_jobs(client, auth_headers):
+    post_id = client.post("/posts", json={"title" : "Title", "body" : "Body"}, headers=auth_headers).json["id"]
+    client.put(f"/posts/{post_id}", json={"title" : "New Title"}, headers=auth_headers)
+    comment_id = client.post(f"/posts/{post_id}/comments", json={"body" : "Comment"}, headers=auth_headers).json["id"]
+    client.delete(f"/posts/{post_id}/comments/{comment_id}", headers=auth_headers)
+    client.delete(f"/posts/{post_id}", headers=auth_headers)
+
+    user_id = db.session.scalar(db.select(User.id))
+    post = {"id" : post_id, "user_id" : user_id}
+    comment = {"id" : comment_id, "user_id" : user_id, "post_id" : post_id}
+    assert queued() == [
+        ("post.created", post),
+        ("post.updated", post),
+        ("comment.created", comment),
+        ("comment.deleted", comment),
+        ("post.deleted", post),
+    ]
+
+
+def test_bulk_writes_queue_a_job_per_item(client, auth_headers):
+    response = client.post("/posts/bulk", json=[{"title" : f"Title {i}", "body" : "Body"} for i in range(3)], headers=auth_headers)
+    assert response.status_code == 201
+    post_ids = [result["id"] for result in response.json["results"]]
+    response = client.post(f"/posts/{post_ids[0]}/comments/bulk", json=[{"body" : "Comment"}] * 2, headers=auth_headers)
+    assert response.status_code == 201
+
+    kinds = [kind for kind, _ in queued()]
+    assert kinds == ["post.created"] * 3 + ["comment.created"] * 2
+    assert [payload["id"] for kind, payload in queued() if kind == "post.created"] == post_ids
+
+
+def test_handlers_run_and_jobs_are_deleted(client, auth_headers):
+    seen = []
+    jobs.job_handler("post.created")(seen.append)
+    post_id = client.post("/posts", json={"title" : "Title", "body" : "Body"}, headers=auth_headers).json["id"]
+    client.post(f"/posts/{post_id}/comments", json={"body" : "Comment"}, headers=auth_headers)
+
+    # jobs without handlers are finished too
+    assert jobs.run_pending_jobs() == 2
+    assert [payload["id"] for payload in seen] == [post_id]
+    assert queued() == []
+
+
+def test_failing_job_is_retried_then_failed(app):
+    def broken(payload):
+        raise RuntimeError("handler broke")
+    jobs.job_handler("post.deleted")(broken)
+    db.session.add(Job(kind="post.deleted", payload={"id" : 1}))
+    db.session.commit()
+
+    assert jobs.run_pending_jobs() == 1
+    job = get_job()
+    assert (job.status, job.attempts) == ("pending", 1)
+    assert "handler broke" in job.last_error
+    # not again until the retry delay is over
+    assert jobs.run_pending_jobs() == 0
+
+    for attempt in range(2, app.config["JOB_MAX_ATTEMPTS"] + 1):
+        make_due(job)
+        assert jobs.run_pending_jobs() == 1
+        job = get_job()
+        assert job.attempts == attempt
+    assert job.status == "failed"
+    make_due(job)
+    assert jobs.run_pending_jobs() == 0
+
+
+def test_rolled_back_write_queues_nothing(app):
+    user = User(first_name="Job", last_name="Tester", username="jobs", email="jobs@example.com", password="password")
+    db.session.add(user)
+    db.session.commit()
+
+    # with UNIT_OF_WORK the models only flush, so the request can still roll everything back
+    app.config["UNIT_OF_WORK"] = True
+    Post(title="Title", body="Body", user_id=user.id)
+    Post.bulk_insert([{"title" : "Bulk Title", "body" : "Body", "user_id" : user.id}])
+    assert [kind for kind, _ in queued()] == ["post.created"] * 2
+    db.session.rollback()
+    assert queued() == []
+
+
+def test_expired_lease_is_claimed_again(app):
+    db.session.add(Job(kind="post.created", payload={"id" : 1}))
+    db.session.commit()
+
+    job = jobs.claim_job()
+    assert (job.status, job.attempts) == ("running", 1)
+    # the lease is still running, no other worker gets it
+    assert jobs.claim_job() is None
+
+    # the worker died, once the lease is over the job is handed out again
+    make_due(job)
+    job = jobs.claim_job()
+    assert (job.status, job.attempts) == ("running", 2)
+
+
+def test_job_that_keeps_killing_its_worker_is_failed(app):
+    db.session.add(Job(kind="post.created", payload={"id" : 1}))
+    db.session.commit()
+
+    # every claim's worker dies before run_job can record anything
+    for _ in range(app.config["JOB_MAX_ATTEMPTS"]):
+        job = jobs.claim_job()
+        assert job is not None
+        make_due(job)
+
+    assert jobs.claim_job() is None
+    job = get_job()
+    assert (job.status, job.attempts) == ("failed", app.config["JOB_MAX_ATTEMPTS"])
+    assert "Lease ran out" in job.last_error
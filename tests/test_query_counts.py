@@ -0,0 +1,66 @@
+# The listing routes must run the same number of queries however much data there is
+# A route that lazy loads an author or the comments per row (N+1) runs more queries on the bigger
+# database, since its pages hold more rows and its hot post has more comments
+# Run from the project root: pip install -r requirements-dev.txt, then python -m pytest
+
+import pytest
+from sqlalchemy import event
+from app import create_app, db
+from config import Config
+from fake_data.generate import generate
+
+ROUTES = [
+    "/posts",
+    "/posts?limit=100",
+    "/posts?view=summary",
+    "/posts/{post_id}",
+    "/posts/{post_id}/comments",
+    "/posts/{post_id}/comments?limit=100",
+]
+
+
+def make_config(database_path):
+    return type("QueryCountConfig", (Config,), {
+        "SQLALCHEMY_DATABASE_URI" : f"sqlite:///{database_path}",
+        "SQLALCHEMY_BINDS" : {},
+        "RESPONSE_CACHE_BACKEND" : "none",
+        "RATE_LIMIT_BACKEND" : "none",
+        "JOB_WORKER_THREADS" : 0,
+        "PASSWORD_HASH_WORKERS" : 0,
+    })
+
+
+# Seed a database at the given scale and count the queries each route runs on it
+def count_route_queries(database_path, scale):
+    app = create_app(make_config(database_path))
+    with app.app_context():
+        db.create_all()
+        summary = generate(10 * scale, 50 * scale, 200 * scale)
+        engine = db.engine
+    post_id = summary['hot_post_ids'][0]
+    client = app.test_client()
+
+    counts = {}
+    for route in ROUTES:
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            response = client.get(route.format(post_id=post_id))
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        assert response.status_code == 200, (route, response.json)
+        counts[route] = len(statements)
+    return counts
+
+
+@pytest.fixture(scope="module")
+def query_counts(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("query_counts")
+    return count_route_queries(directory / "small.db", 1), count_route_queries(directory / "large.db", 3)
+
+
+@pytest.mark.parametrize("route", ROUTES)
+def test_query_count_does_not_grow_with_the_data(query_counts, route):
+    small, large = query_counts
+    assert large[route] == small[route]
@@ -0,0 +1,7 @@
+# WSGI entry point
+#   gunicorn wsgi:app
+# The flask command finds this file too, so flask db upgrade / flask check-query-plans use the same app
+
+from app import create_app
+
+app = create_app()